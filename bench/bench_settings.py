@@ -0,0 +1,35 @@
+# minimal django settings for running cfingestor against the sqlite-backed
+# coldfront stand-in in bench/standin
+import os
+
+import django
+
+SECRET_KEY = "cfingestor-bench"
+USE_TZ = True
+DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
+INSTALLED_APPS = [
+    "django.contrib.contenttypes",
+    "django.contrib.auth",
+    "coldfront.core.user",
+    "coldfront.core.project",
+    "coldfront.core.resource",
+    "coldfront.core.allocation",
+]
+try:
+    import simple_history  # noqa: F401
+
+    INSTALLED_APPS.append("simple_history")
+except ImportError:
+    pass
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get("CFINGESTOR_BENCH_DB", "bench.sqlite3"),
+        "OPTIONS": {"timeout": 30},
+    }
+}
+# concurrent ingest workers read before they write (history rows copy the
+# full row), and sqlite fails a deferred transaction's lock upgrade at once
+# instead of waiting out the timeout, so take the write lock at BEGIN
+if django.VERSION >= (5, 1):
+    DATABASES["default"]["OPTIONS"]["transaction_mode"] = "IMMEDIATE"
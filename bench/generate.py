@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# generates synthetic manifests in the format POST /manifest accepts
+#
+#   python bench/generate.py --users 10000 --projects 1000 > manifest.json
+#   python bench/generate.py --from manifest.json --churn 0.01 > manifest2.json
+
+import argparse
+import json
+import random
+import sys
+
+
+def generate_manifest(
+    users: int,
+    projects: int,
+    members: int = 8,
+    admins: int = 1,
+    seed: int = 0,
+) -> dict:
+    rng = random.Random(seed)
+    usernames = [f"user{i}" for i in range(users)]
+    return {
+        "users": [new_user(username) for username in usernames],
+        "projects": [
+            new_project(f"project{i}", usernames, members, admins, rng)
+            for i in range(projects)
+        ],
+    }
+
+
+def new_user(username: str) -> dict:
+    return {
+        "username": username,
+        "firstname": f"{username}first",
+        "lastname": f"{username}last",
+    }
+
+
+def new_project(name: str, usernames: list, members: int, admins: int, rng) -> dict:
+    n = max(1, min(len(usernames), int(rng.expovariate(1 / members)) + 1))
+    project_users = rng.sample(usernames, n)
+    return {
+        "name": name,
+        "owner": project_users[0],
+        "users": project_users,
+        "admins": project_users[: min(admins + 1, n)],
+    }
+
+
+def churn_manifest(
+    manifest: dict, rate: float, members: int = 8, admins: int = 1, seed: int = 1
+) -> dict:
+    # removes and adds rate * len(users) users and rate * len(projects)
+    # projects, and moves rate * len(projects) memberships
+    rng = random.Random(seed)
+    users = [dict(u) for u in manifest["users"]]
+    projects = [
+        dict(p, users=list(p["users"]), admins=list(p["admins"]))
+        for p in manifest["projects"]
+    ]
+    n_users = int(len(users) * rate)
+    n_projects = int(len(projects) * rate)
+
+    removed = {u["username"] for u in rng.sample(users, min(n_users, len(users)))}
+    users = [u for u in users if u["username"] not in removed]
+    next_user = max((int(u["username"][4:]) for u in manifest["users"]), default=-1) + 1
+    users.extend(new_user(f"user{next_user + i}") for i in range(n_users))
+    usernames = [u["username"] for u in users]
+    if not usernames:
+        return {"users": [], "projects": []}
+
+    for p in projects:
+        p["users"] = [u for u in p["users"] if u not in removed]
+        p["admins"] = [u for u in p["admins"] if u not in removed]
+        if p["owner"] in removed:
+            p["owner"] = p["users"][0] if p["users"] else rng.choice(usernames)
+            if p["owner"] not in p["users"]:
+                p["users"].insert(0, p["owner"])
+
+    for _ in range(n_projects):
+        if not projects:
+            break
+        p = rng.choice(projects)
+        username = rng.choice(usernames)
+        if username in p["users"] and username != p["owner"]:
+            p["users"].remove(username)
+            if username in p["admins"]:
+                p["admins"].remove(username)
+        elif username not in p["users"]:
+            p["users"].append(username)
+
+    for p in rng.sample(projects, min(n_projects, len(projects))):
+        projects.remove(p)
+    next_project = (
+        max((int(p["name"][7:]) for p in manifest["projects"]), default=-1) + 1
+    )
+    projects.extend(
+        new_project(f"project{next_project + i}", usernames, members, admins, rng)
+        for i in range(n_projects)
+    )
+    return {"users": users, "projects": projects}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate a synthetic manifest")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--projects", type=int, default=100)
+    parser.add_argument("--members", type=int, default=8, help="mean project size")
+    parser.add_argument("--admins", type=int, default=1, help="admins per project")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--from", dest="base", help="manifest to apply churn to")
+    parser.add_argument("--churn", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.base:
+        with open(args.base) as f:
+            manifest = json.load(f)
+    else:
+        manifest = generate_manifest(
+            args.users, args.projects, args.members, args.admins, args.seed
+        )
+    if args.churn:
+        manifest = churn_manifest(
+            manifest, args.churn, args.members, args.admins, args.seed + 1
+        )
+    json.dump(manifest, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# runs cfingestor against a local sqlite-backed coldfront stand-in and reports
+# wall time, query count and rows written for POST /manifest and each ingest
+# phase. needs django and flask installed, but not coldfront.
+#
+#   python bench/run.py --users 10000 --projects 1000 --runs 3 --churn 0.01
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "standin"))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import generate  # noqa: E402
+
+
+class QueryCounter:
+    # django execute_wrapper counting the queries a request issues
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def setup(workdir: str):
+    os.environ["CFINGESTOR_RUN_DIR"] = os.path.join(workdir, "run")
+    os.environ["CFINGESTOR_BENCH_DB"] = os.path.join(workdir, "bench.sqlite3")
+    os.environ["DJANGO_SETTINGS_MODULE"] = "bench_settings"
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    seed_choices()
+
+    import main
+
+    return main, main.create_app()
+
+
+def seed_choices():
+    from coldfront.core.allocation.models import (
+        AllocationStatusChoice,
+        AllocationUserStatusChoice,
+    )
+    from coldfront.core.project.models import (
+        ProjectStatusChoice,
+        ProjectUserRoleChoice,
+        ProjectUserStatusChoice,
+    )
+    from coldfront.core.resource.models import ResourceType
+    from django.contrib.auth.models import User
+
+    for model, names in [
+        (ProjectStatusChoice, ["New", "Active", "Archived"]),
+        (ProjectUserRoleChoice, ["User", "Manager"]),
+        (ProjectUserStatusChoice, ["Active", "Pending - Add", "Removed"]),
+        (AllocationStatusChoice, ["Active", "Expired"]),
+        (AllocationUserStatusChoice, ["Active", "Removed"]),
+        (ResourceType, ["Cluster"]),
+    ]:
+        for name in names:
+            model.objects.get_or_create(name=name)
+    if not User.objects.filter(username="admin").exists():
+        User.objects.create_superuser("admin", "admin@localhost", "admin")
+
+
+def post_manifest(app, manifest: dict) -> dict:
+    from django.db import connection
+
+    body = json.dumps(manifest).encode()
+    counter = QueryCounter()
+    client = app.test_client()
+    start = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        response = client.post(
+            "/manifest",
+            data=body,
+            headers={
+                "Content-Hash": hashlib.sha256(body).hexdigest(),
+                "Content-Type": "application/json",
+            },
+        )
+    elapsed = time.perf_counter() - start
+    if response.status_code >= 400:
+        raise Exception(f"POST /manifest failed: {response.get_json()}")
+    return {
+        "bytes": len(body),
+        "seconds": elapsed,
+        "queries": counter.queries,
+    }
+
+
+def run_ingest(main, full: bool) -> dict:
+    from django.db import connection
+
+    # runs the job in this thread rather than on the ingest queue's worker,
+    # with the same per-phase query accounting the worker installs
+    job = main.IngestJob(full=full)
+    job.start()
+    with connection.execute_wrapper(job.query_wrapper):
+        result, status_code = main.run_ingest(job)
+    job.finish(result, status_code)
+    if status_code >= 400:
+        raise Exception(f"ingest failed: {result}")
+    return {
+        "seconds": job.elapsed(),
+        "phases": job.phases,
+        "result": result,
+    }
+
+
+def print_run(i: int, manifest_stats: dict, ingest_stats: dict):
+    print(
+        f"run {i}: POST /manifest {manifest_stats['bytes']} bytes "
+        f"in {manifest_stats['seconds']:.3f}s, {manifest_stats['queries']} queries"
+    )
+    print(f"run {i}: ingest {ingest_stats['result'].get('status')}")
+    print(f"  {'phase':<18}{'seconds':>10}{'queries':>10}{'query s':>10}{'rows':>10}")
+    for phase, p in ingest_stats["phases"].items():
+        print(
+            f"  {phase:<18}{p['seconds']:>10.3f}{p['queries']:>10}"
+            f"{p['query_seconds']:>10.3f}{p['processed']:>10}"
+        )
+    print(f"  {'total':<18}{ingest_stats['seconds']:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark cfingestor ingests")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--projects", type=int, default=100)
+    parser.add_argument("--members", type=int, default=8, help="mean project size")
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--churn", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--full", action="store_true", help="force full ingests")
+    parser.add_argument("--workdir", help="keep the database and run dir here")
+    parser.add_argument("--json", action="store_true", help="print results as json")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="cfingestor-bench-")
+    os.makedirs(os.path.join(workdir, "run"), exist_ok=True)
+    main_module, app = setup(workdir)
+
+    manifest = generate.generate_manifest(
+        args.users, args.projects, args.members, seed=args.seed
+    )
+    results = []
+    for i in range(args.runs):
+        if i > 0:
+            manifest = generate.churn_manifest(
+                manifest, args.churn, args.members, seed=args.seed + i
+            )
+        manifest_stats = post_manifest(app, manifest)
+        ingest_stats = run_ingest(main_module, args.full)
+        results.append({"manifest": manifest_stats, "ingest": ingest_stats})
+        if not args.json:
+            print_run(i, manifest_stats, ingest_stats)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# stand-in for the coldfront allocation models, with only the fields cfingestor uses
+from coldfront.core.project.models import Project
+from coldfront.core.resource.models import Resource
+from coldfront.core.utils.models import HistoricalRecords, TimeStampedModel
+from django.contrib.auth.models import User
+from django.db import models
+
+
+class AllocationStatusChoice(models.Model):
+    name = models.CharField(max_length=64)
+
+
+class AllocationUserStatusChoice(models.Model):
+    name = models.CharField(max_length=64)
+
+
+class Allocation(TimeStampedModel):
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    resources = models.ManyToManyField(Resource)
+    status = models.ForeignKey(AllocationStatusChoice, on_delete=models.CASCADE)
+    start_date = models.DateField()
+    end_date = models.DateField()
+
+    if HistoricalRecords is not None:
+        history = HistoricalRecords()
+
+
+class AllocationUser(TimeStampedModel):
+    allocation = models.ForeignKey(Allocation, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.ForeignKey(AllocationUserStatusChoice, on_delete=models.CASCADE)
+
+    if HistoricalRecords is not None:
+        history = HistoricalRecords()
+
+    class Meta:
+        unique_together = ("user", "allocation")
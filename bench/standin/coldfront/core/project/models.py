@@ -0,0 +1,41 @@
+# stand-in for the coldfront project models, with only the fields cfingestor uses
+from coldfront.core.utils.models import HistoricalRecords, TimeStampedModel
+from django.contrib.auth.models import User
+from django.db import models
+
+
+class ProjectStatusChoice(models.Model):
+    name = models.CharField(max_length=64)
+
+
+class ProjectUserRoleChoice(models.Model):
+    name = models.CharField(max_length=64)
+
+
+class ProjectUserStatusChoice(models.Model):
+    name = models.CharField(max_length=64)
+
+
+class Project(TimeStampedModel):
+    title = models.CharField(max_length=255)
+    pi = models.ForeignKey(User, on_delete=models.CASCADE)
+    description = models.TextField()
+    status = models.ForeignKey(ProjectStatusChoice, on_delete=models.CASCADE)
+    requires_review = models.BooleanField(default=True)
+    force_review = models.BooleanField(default=False)
+
+    if HistoricalRecords is not None:
+        history = HistoricalRecords()
+
+
+class ProjectUser(TimeStampedModel):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    role = models.ForeignKey(ProjectUserRoleChoice, on_delete=models.CASCADE)
+    status = models.ForeignKey(ProjectUserStatusChoice, on_delete=models.CASCADE)
+
+    if HistoricalRecords is not None:
+        history = HistoricalRecords()
+
+    class Meta:
+        unique_together = ("user", "project")
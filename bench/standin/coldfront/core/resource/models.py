@@ -0,0 +1,16 @@
+# stand-in for the coldfront resource models, with only the fields cfingestor uses
+from django.db import models
+
+
+class ResourceType(models.Model):
+    name = models.CharField(max_length=128)
+
+
+class Resource(models.Model):
+    name = models.CharField(max_length=128, unique=True)
+    description = models.TextField()
+    resource_type = models.ForeignKey(ResourceType, on_delete=models.CASCADE)
+    is_allocatable = models.BooleanField(default=True)
+    is_available = models.BooleanField(default=True)
+    is_public = models.BooleanField(default=True)
+    requires_payment = models.BooleanField(default=False)
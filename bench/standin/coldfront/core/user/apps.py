@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class UserConfig(AppConfig):
+    name = "coldfront.core.user"
+
+    def ready(self):
+        import coldfront.core.user.signals  # noqa: F401
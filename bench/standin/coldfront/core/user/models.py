@@ -0,0 +1,8 @@
+# stand-in for the coldfront user models, with only the fields cfingestor uses
+from django.contrib.auth.models import User
+from django.db import models
+
+
+class UserProfile(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    is_pi = models.BooleanField(default=False)
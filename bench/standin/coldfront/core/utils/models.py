@@ -0,0 +1,17 @@
+# stand-in for coldfront's TimeStampedModel base and its optional
+# django-simple-history records. bulk writes bypass both, so the bench
+# models them when django-simple-history is installed.
+from django.db import models
+
+try:
+    from simple_history.models import HistoricalRecords
+except ImportError:
+    HistoricalRecords = None
+
+
+class TimeStampedModel(models.Model):
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
@@ -1,200 +1,696 @@
 #!/usr/bin/env python
 
+import atexit
 import logging
-
-logging.basicConfig(level=logging.INFO)
-
+import logging.handlers
+import fcntl
+import gzip
+import hashlib
 import json
 import os
-
-from coldfront.core.allocation.models import (
-    Allocation,
-    AllocationStatusChoice,
-    AllocationUser,
-    AllocationUserStatusChoice,
-)
-from coldfront.core.project.models import (
-    Project,
-    ProjectStatusChoice,
-    ProjectUser,
-    ProjectUserRoleChoice,
-    ProjectUserStatusChoice,
-)
-from coldfront.core.resource.models import Resource, ResourceType
-from django.contrib.auth.models import User
+import sys
+import queue
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.apps import apps
+from django.db import connection, transaction
+from django.db import connections as db_connections
+from django.core.exceptions import FieldDoesNotExist
 from django.db.models import Q
-from flask import Flask, request
-
-RUN_DIR = "/var/run/cfingestor"
+from django.utils import timezone
+from flask import Blueprint, Flask, Response, g, request
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+except ImportError:
+    bulk_create_with_history = bulk_update_with_history = None
+
+RUN_DIR = os.environ.get("CFINGESTOR_RUN_DIR", "/var/run/cfingestor")
+JOBS_DIR = f"{RUN_DIR}/jobs"
+BIND = os.environ.get("CFINGESTOR_BIND", "0.0.0.0:8090")
+WORKERS = int(os.environ.get("CFINGESTOR_WORKERS", "1"))
+THREADS = int(os.environ.get("CFINGESTOR_THREADS", "8"))
+LOG_LEVEL = os.environ.get("CFINGESTOR_LOG_LEVEL", "INFO").upper()
+# "text", or "json" for one object per line including the fields of
+# structured records such as the ingest phase summaries
+LOG_FORMAT = os.environ.get("CFINGESTOR_LOG_FORMAT", "text")
+# threads applying the per-project phases of an ingest, 1 applies in order
+INGEST_CONCURRENCY = int(os.environ.get("CFINGESTOR_INGEST_CONCURRENCY", "1"))
+# queue an ingest by itself once new manifests stop arriving for this long
+AUTO_INGEST = os.environ.get("CFINGESTOR_AUTO_INGEST", "").lower() in ("1", "true", "yes")
+AUTO_INGEST_DELAY = float(os.environ.get("CFINGESTOR_AUTO_INGEST_DELAY", "30"))
+AUTO_INGEST_RETRY_INTERVAL = 5.0
+# scopes touching more users and projects than this load a full snapshot
+SCOPED_SNAPSHOT_LIMIT = 1000
 DOMAIN = "uoregon.edu"
 RESOURCE_NAME = "Talapas2"
 RESOURCE_DESCRIPTION = "University of Oregon HPC Cluster"
 ALLOCATION_START_DATE = "2024-01-01"
 ALLOCATION_END_DATE = "2024-12-31"
+BULK_CREATE_BATCH_SIZE = 500
+BULK_UPDATE_BATCH_SIZE = 500
+INGEST_CHUNK_SIZE = 1000
+MANIFEST_READ_CHUNK_SIZE = 1024 * 1024
+# largest manifest accepted after decompression, in bytes. decoded bodies
+# are written to RUN_DIR, often a tmpfs, so this bounds the memory a
+# compression bomb can take per request
+MANIFEST_MAX_SIZE = int(
+    os.environ.get("CFINGESTOR_MANIFEST_MAX_SIZE", str(64 * 1024 * 1024))
+)
+# manifests above this are parsed incrementally with ijson. kept well below
+# the size limit so raising or lowering the limit never disables streaming
+MANIFEST_STREAM_THRESHOLD = min(16 * 1024 * 1024, MANIFEST_MAX_SIZE // 4)
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+INGEST_JOB_HISTORY = 100
+INGEST_JOB_SAVE_INTERVAL = 1.0
+MANIFEST_GZIP_LEVEL = 6
+MANIFEST_ZSTD_LEVEL = 3
+
+# coldfront and django models, bound by load_models once django is set up
+Allocation = AllocationStatusChoice = AllocationUser = None
+AllocationUserStatusChoice = Project = ProjectStatusChoice = ProjectUser = None
+ProjectUserRoleChoice = ProjectUserStatusChoice = Resource = ResourceType = None
+UserProfile = User = None
+
+
+def setup_django():
+    # only the app registry, none of what coldfront shell loads on top
+    if not apps.ready:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "coldfront.config.settings")
+        django.setup()
+    load_models()
+
+
+def load_models():
+    global Allocation, AllocationStatusChoice, AllocationUser
+    global AllocationUserStatusChoice, Project, ProjectStatusChoice, ProjectUser
+    global ProjectUserRoleChoice, ProjectUserStatusChoice, Resource, ResourceType
+    global UserProfile, User
+    from coldfront.core.allocation.models import (
+        Allocation,
+        AllocationStatusChoice,
+        AllocationUser,
+        AllocationUserStatusChoice,
+    )
+    from coldfront.core.project.models import (
+        Project,
+        ProjectStatusChoice,
+        ProjectUser,
+        ProjectUserRoleChoice,
+        ProjectUserStatusChoice,
+    )
+    from coldfront.core.resource.models import Resource, ResourceType
+    from coldfront.core.user.models import UserProfile
+    from django.contrib.auth.models import User
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LogQueue:
+    # records are handed to a queue and written to stderr by a listener
+    # thread, so request and ingest threads never block on the write. the
+    # listener is restarted in forked workers, where its thread is gone.
+    def __init__(self, handler: logging.Handler):
+        self.handler = handler
+        self.queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        self.listener = None
+        self.start()
+
+    def start(self):
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(
+            self.queue_handler.queue, self.handler, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+
+
+def setup_logging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    log_queue = LogQueue(handler)
+    root = logging.getLogger()
+    root.handlers = [log_queue.queue_handler]
+    root.setLevel(LOG_LEVEL)
+    atexit.register(log_queue.stop)
+    os.register_at_fork(after_in_child=log_queue.start)
+
+
+# snapshot rows: just the columns reconciliation reads
+UserRow = namedtuple("UserRow", ("id", "username", "is_active"))
+ProjectRow = namedtuple(
+    "ProjectRow", ("id", "title", "status_id", "requires_review", "description")
+)
+AssociationRow = namedtuple(
+    "AssociationRow", ("id", "user_id", "project_id", "role_id", "status_id")
+)
+ResourceRow = namedtuple("ResourceRow", ("id", "name"))
+AllocationRow = namedtuple("AllocationRow", ("id", "project_id", "status_id"))
+AllocationUserRow = namedtuple(
+    "AllocationUserRow", ("id", "user_id", "allocation_id", "status_id")
+)
 
 
-def is_ingest_locked() -> bool:
-    return os.path.exists(f"{RUN_DIR}/ingest.lock")
-
-
-def lock_ingest():
-    with open(f"{RUN_DIR}/ingest.lock", "w") as f:
-        f.write("")
-
-
-def unlock_ingest():
-    if is_ingest_locked():
-        os.remove(f"{RUN_DIR}/ingest.lock")
-
+def load_rows(row_type, queryset) -> list:
+    return [row_type._make(r) for r in queryset.values_list(*row_type._fields)]
 
-def exit_error(obj: dict) -> dict:
-    unlock_ingest()
-    return obj
 
+def rows_from(row_type, objs) -> list:
+    # snapshot rows for model instances just written
+    return [row_type._make(getattr(o, f) for f in row_type._fields) for o in objs]
 
-# unlock ingest if it's locked
-if is_ingest_locked():
-    unlock_ingest()
 
-# Create /var/run/cfingestor directory if it doesn't exist
-if not os.path.exists(RUN_DIR):
-    os.makedirs(RUN_DIR)
+def replace_rows(rows: list, **fields) -> list:
+    return [r._replace(**fields) for r in rows]
 
 
 class ColdfrontModelManager:
-    def __init__(self):
-        self.coldfront_users = list(User.objects.all())
-        self.coldfront_projects = list(Project.objects.all())
-        self.coldfront_associations = list(ProjectUser.objects.all())
-        self.coldfront_resources = list(Resource.objects.all())
-        self.coldfront_allocations = list(Allocation.objects.all())
-        self.coldfront_allocation_users = list(AllocationUser.objects.all())
+    # snapshot of the coldfront rows an ingest reconciles. given an expanded
+    # IngestScope that is not too large, only the rows the scope can touch
+    # are loaded, plus the users and projects those rows reference.
+    # rows are the named tuples above, related rows are looked up through
+    # the id indexes, and model instances are only built when a row is
+    # written. the snapshot is loaded once and kept current by the apply
+    # phases through the put_* methods; refresh() reloads it from the db.
+    def __init__(self, scope=None):
+        self.scope = None
+        if scope is not None and not scope.everything and (
+            len(scope.touched_usernames) + len(scope.touched_projects)
+            <= SCOPED_SNAPSHOT_LIMIT
+        ):
+            self.scope = scope
+        self.project_statuses = choices_by_name(ProjectStatusChoice)
+        self.project_user_roles = choices_by_name(ProjectUserRoleChoice)
+        self.project_user_statuses = choices_by_name(ProjectUserStatusChoice)
+        self.allocation_statuses = choices_by_name(AllocationStatusChoice)
+        self.allocation_user_statuses = choices_by_name(AllocationUserStatusChoice)
+        self.refresh()
+
+    def refresh(self):
+        # memberships first, a scoped snapshot loads the users and projects
+        # they reference
+        self.refresh_associations()
+        self.refresh_allocation_users()
+        self.refresh_allocations()
+        self.refresh_projects()
+        self.refresh_users()
+        self.refresh_resources()
+
+    @property
+    def coldfront_users(self) -> list:
+        return list(self.users_by_id.values())
+
+    @property
+    def coldfront_projects(self) -> list:
+        return list(self.projects_by_id.values())
+
+    @property
+    def coldfront_associations(self) -> list:
+        return list(self.associations_by_key.values())
+
+    @property
+    def coldfront_resources(self) -> list:
+        return list(self.resources_by_name.values())
+
+    @property
+    def coldfront_allocations(self) -> list:
+        return list(self.allocations_by_id.values())
+
+    @property
+    def coldfront_allocation_users(self) -> list:
+        return list(self.allocation_users_by_key.values())
 
     def refresh_users(self):
-        self.coldfront_users = list(User.objects.all())
+        users = User.objects.all()
+        if self.scope is not None:
+            ids = {a.user_id for a in self.coldfront_associations}
+            ids.update(au.user_id for au in self.coldfront_allocation_users)
+            users = users.filter(
+                Q(username__in=self.scope.touched_usernames) | Q(id__in=ids)
+            )
+        self.users_by_id = {}
+        self.users_by_username = {}
+        self.put_users(load_rows(UserRow, users))
 
     def refresh_projects(self):
-        self.coldfront_projects = list(Project.objects.all())
+        projects = Project.objects.all()
+        if self.scope is not None:
+            ids = {a.project_id for a in self.coldfront_associations}
+            ids.update(a.project_id for a in self.coldfront_allocations)
+            projects = projects.filter(
+                Q(title__in=self.scope.touched_projects) | Q(id__in=ids)
+            )
+        self.projects_by_id = {}
+        self.projects_by_title = {}
+        self.put_projects(load_rows(ProjectRow, projects))
 
     def refresh_associations(self):
-        self.coldfront_associations = list(ProjectUser.objects.all())
+        associations = ProjectUser.objects.all()
+        if self.scope is not None:
+            associations = associations.filter(
+                Q(project__title__in=self.scope.touched_projects)
+                | Q(user__username__in=self.scope.usernames)
+            )
+        self.associations_by_key = {}
+        self.put_associations(load_rows(AssociationRow, associations))
 
     def refresh_resources(self):
-        self.coldfront_resources = list(Resource.objects.all())
+        self.resources_by_name = {}
+        self.put_resources(load_rows(ResourceRow, Resource.objects.all()))
 
     def refresh_allocations(self):
-        self.coldfront_allocations = list(Allocation.objects.all())
+        allocations = Allocation.objects.all()
+        if self.scope is not None:
+            ids = {au.allocation_id for au in self.coldfront_allocation_users}
+            allocations = allocations.filter(
+                Q(project__title__in=self.scope.touched_projects) | Q(id__in=ids)
+            )
+        self.allocations_by_id = {}
+        self.allocations_by_project = {}
+        self.put_allocations(load_rows(AllocationRow, allocations))
 
     def refresh_allocation_users(self):
-        self.coldfront_allocation_users = list(AllocationUser.objects.all())
+        allocation_users = AllocationUser.objects.all()
+        if self.scope is not None:
+            allocation_users = allocation_users.filter(
+                Q(allocation__project__title__in=self.scope.touched_projects)
+                | Q(user__username__in=self.scope.usernames)
+            )
+        self.allocation_users_by_key = {}
+        self.put_allocation_users(load_rows(AllocationUserRow, allocation_users))
+
+    def put(self, entity: str, rows: list):
+        {
+            "user": self.put_users,
+            "project": self.put_projects,
+            "project_user": self.put_associations,
+            "resource": self.put_resources,
+            "allocation": self.put_allocations,
+            "allocation_user": self.put_allocation_users,
+        }[entity](rows)
+
+    # put_* add or replace snapshot rows, keeping every index in step
+
+    def put_users(self, rows: list):
+        for u in rows:
+            self.users_by_id[u.id] = u
+            self.users_by_username[u.username] = u
+
+    def put_projects(self, rows: list):
+        for p in rows:
+            self.projects_by_id[p.id] = p
+            self.projects_by_title[p.title] = p
+
+    def put_associations(self, rows: list):
+        for a in rows:
+            self.associations_by_key[(a.user_id, a.project_id)] = a
+
+    def put_resources(self, rows: list):
+        for r in rows:
+            self.resources_by_name[r.name] = r
+
+    def put_allocations(self, rows: list):
+        # keeps the first allocation per project, like index_allocations
+        for a in rows:
+            self.allocations_by_id[a.id] = a
+            current = self.allocations_by_project.get(a.project_id)
+            if current is None or current.id == a.id:
+                self.allocations_by_project[a.project_id] = a
+
+    def put_allocation_users(self, rows: list):
+        for au in rows:
+            self.allocation_users_by_key[(au.user_id, au.allocation_id)] = au
+
+    def get_user(self, username: str):
+        return self.users_by_username.get(username)
+
+    def get_project(self, title: str):
+        return self.projects_by_title.get(title)
+
+    def get_association(self, user, project):
+        return self.associations_by_key.get((user.id, project.id))
+
+    def get_allocation(self, project):
+        return get_allocation(project, self.allocations_by_project)
+
+    def get_allocation_user(self, user, allocation):
+        return self.allocation_users_by_key.get((user.id, allocation.id))
+
+    # change feed keys and states, by name rather than id
+
+    def change_key(self, entity: str, row) -> dict:
+        if entity == "user":
+            return {"username": row.username}
+        if entity == "project":
+            return {"title": row.title}
+        if entity == "resource":
+            return {"name": row.name}
+        if entity == "allocation":
+            return {"project": self.projects_by_id[row.project_id].title}
+        if entity == "project_user":
+            project_id = row.project_id
+        else:
+            project_id = self.allocations_by_id[row.allocation_id].project_id
+        return {
+            "username": self.users_by_id[row.user_id].username,
+            "project": self.projects_by_id[project_id].title,
+        }
+
+    def change_state(self, entity: str, row) -> dict:
+        if entity == "user":
+            return {"is_active": row.is_active}
+        if entity == "project":
+            return {"status": choice_name(self.project_statuses, row.status_id)}
+        if entity == "project_user":
+            return {
+                "role": choice_name(self.project_user_roles, row.role_id),
+                "status": choice_name(self.project_user_statuses, row.status_id),
+            }
+        if entity == "allocation":
+            return {"status": choice_name(self.allocation_statuses, row.status_id)}
+        if entity == "allocation_user":
+            return {
+                "status": choice_name(self.allocation_user_statuses, row.status_id)
+            }
+        return {}
 
 
-class UserTracker:
-    def __init__(self, users: list):
-        self.eu = [u for u in users]
+def choice_name(choices: dict, choice_id: int) -> str | None:
+    for name, choice in choices.items():
+        if choice.id == choice_id:
+            return name
+    return None
+
+
+def choices_by_name(model) -> dict:
+    return {c.name: c for c in model.objects.all()}
 
-    def tick(self, user):
-        for i, u in enumerate(self.eu):
-            if u.id == user.id:
-                self.eu.pop(i)
+
+def chunked(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+# coldfront's projects, memberships and allocations keep django-simple-history
+# records and a TimeStampedModel modified time, both normally maintained by
+# save(). the bulk writes below keep them up to date themselves.
+HISTORY_CHANGE_REASON = "cfingestor ingest"
+
+
+def has_history(model) -> bool:
+    return bulk_create_with_history is not None and hasattr(
+        model._meta, "simple_history_manager_attribute"
+    )
+
+
+def has_modified(model) -> bool:
+    try:
+        model._meta.get_field("modified")
+        return True
+    except FieldDoesNotExist:
+        return False
+
+
+def bulk_create(model, objs: list) -> list:
+    if has_history(model):
+        return bulk_create_with_history(
+            objs,
+            model,
+            batch_size=BULK_CREATE_BATCH_SIZE,
+            default_change_reason=HISTORY_CHANGE_REASON,
+        )
+    return model.objects.bulk_create(objs, batch_size=BULK_CREATE_BATCH_SIZE)
+
+
+def bulk_update(model, objs: list, fields: list) -> int:
+    # objs may hold only the id and the fields being written. history rows
+    # copy every column, so history-tracked rows are loaded in full first.
+    if has_modified(model):
+        fields = [*fields, "modified"]
+    if not has_history(model):
+        if "modified" in fields:
+            now = timezone.now()
+            for o in objs:
+                o.modified = now
+        return model.objects.bulk_update(
+            objs, fields, batch_size=BULK_UPDATE_BATCH_SIZE
+        )
+    attnames = [model._meta.get_field(f).attname for f in fields if f != "modified"]
+    n = 0
+    for chunk in chunked(objs, BULK_UPDATE_BATCH_SIZE):
+        full = model.objects.in_bulk([o.id for o in chunk])
+        now = timezone.now()
+        rows = []
+        for o in chunk:
+            row = full.get(o.id)
+            if row is None:
+                continue
+            for name in attnames:
+                setattr(row, name, getattr(o, name))
+            if "modified" in fields:
+                row.modified = now
+            rows.append(row)
+        bulk_update_with_history(
+            rows,
+            model,
+            fields,
+            batch_size=BULK_UPDATE_BATCH_SIZE,
+            default_change_reason=HISTORY_CHANGE_REASON,
+        )
+        n += len(rows)
+    return n
+
+
+def update_by_ids(model, ids: list, **fields) -> int:
+    # one filtered UPDATE per batch instead of a save() per row
+    if has_history(model):
+        objs = [model(id=i, **fields) for i in ids]
+        return bulk_update(model, objs, list(fields))
+    if has_modified(model):
+        fields["modified"] = timezone.now()
+    n = 0
+    for chunk in chunked(ids, BULK_UPDATE_BATCH_SIZE):
+        n += model.objects.filter(id__in=chunk).update(**fields)
+    return n
+
+
+def create_users(users: list) -> list:
+    User.objects.bulk_create(users, batch_size=BULK_CREATE_BATCH_SIZE)
+    fetch_created_ids(User, users, "username")
+    # bulk_create skips post_save, so create the profiles coldfront's
+    # signal handler would otherwise have made
+    UserProfile.objects.bulk_create(
+        [UserProfile(user_id=u.id) for u in users],
+        batch_size=BULK_CREATE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    return users
+
+
+def fetch_created_ids(model, objs: list, *keys: str):
+    # bulk_create sets primary keys on databases that return them from the
+    # insert; elsewhere look them up by the columns that identify each row
+    missing = {tuple(getattr(o, k) for k in keys): o for o in objs if o.pk is None}
+    for chunk in chunked(list(missing), BULK_UPDATE_BATCH_SIZE):
+        q = Q()
+        for values in chunk:
+            q |= Q(**dict(zip(keys, values)))
+        for pk, *values in model.objects.filter(q).values_list("id", *keys):
+            obj = missing.get(tuple(values))
+            if obj is not None:
+                obj.id = pk
+
+
+def write_through(cfmanager, job, entity: str, action: str, old_rows, new_rows: list):
+    # once the rows' transaction commits, puts them into the snapshot and
+    # appends them to the change feed, so chunks and savepoints that roll
+    # back never reach either. old_rows is None for created rows.
+    # the rows are already committed when this runs, so nothing may escape
+    # it: atomic() would report the chunk as failed and skip later hooks
+    def commit():
+        try:
+            cfmanager.put(entity, new_rows)
+        except Exception as e:
+            logging.error(f"error updating snapshot with {entity} rows: {e}")
+        try:
+            change_feed.append(
+                change_records(cfmanager, job, entity, action, old_rows, new_rows)
+            )
+        except Exception as e:
+            logging.error(f"error writing {entity} {action} change records: {e}")
+
+    transaction.on_commit(commit)
+
+
+class KeyedTracker:
+    # existing coldfront rows not yet seen during a sync, keyed by key(row)
+
+    def __init__(self, items: list, key):
+        self.key = key
+        self.items = {key(i): i for i in items}
+
+    def get(self, k):
+        return self.items.get(k)
+
+    def tick_key(self, k):
+        self.items.pop(k, None)
 
     def remaining(self) -> list:
-        return self.eu
+        return list(self.items.values())
+
+
+class UserTracker(KeyedTracker):
+    def __init__(self, users: list):
+        super().__init__(users, key=lambda u: u.id)
+
+    def tick(self, user):
+        self.tick_key(user.id)
 
 
-class ProjectTracker:
+class ProjectTracker(KeyedTracker):
     def __init__(self, projects: list):
-        self.ep = [p for p in projects]
+        super().__init__(projects, key=lambda p: p.id)
 
     def tick(self, project):
-        for i, p in enumerate(self.ep):
-            if p.id == project.id:
-                self.ep.pop(i)
-
-    def remaining(self) -> list:
-        return self.ep
+        self.tick_key(project.id)
 
 
-class ProjectUserTracker:
+class ProjectUserTracker(KeyedTracker):
     def __init__(self, projectusers: list):
-        self.epu = [pu for pu in projectusers]
+        super().__init__(projectusers, key=lambda pu: (pu.user_id, pu.project_id))
 
     def tick(self, user, project):
-        for i, pu in enumerate(self.epu):
-            if pu.user_id == user.id and pu.project_id == project.id:
-                self.epu.pop(i)
-
-    def remaining(self) -> list:
-        return self.epu
+        self.tick_key((user.id, project.id))
 
 
-class ResourceTracker:
+class ResourceTracker(KeyedTracker):
     def __init__(self, resources: list):
-        self.er = [r for r in resources]
+        super().__init__(resources, key=lambda r: r.id)
 
     def tick(self, resource):
-        for i, r in enumerate(self.er):
-            if r.id == resource.id:
-                self.er.pop(i)
-
-    def remaining(self) -> list:
-        return self.er
+        self.tick_key(resource.id)
 
 
-def get_allocation(project: Project, allocations: list) -> Allocation | None:
+def index_allocations(allocations: list) -> dict:
+    """Map project_id -> allocation, keeping the first allocation per project."""
+    index = {}
     for a in allocations:
-        if a.project_id == project.id:
-            return a
+        index.setdefault(a.project_id, a)
+    return index
 
 
-class AllocationTracker:
+def get_allocation(project, allocations: dict):
+    return allocations.get(project.id)
+
+
+class AllocationTracker(KeyedTracker):
     def __init__(self, allocations: list):
-        self.ea = [a for a in allocations]
+        super().__init__(allocations, key=lambda a: a.id)
+        self.by_project = index_allocations(allocations)
 
-    def get(self, project: Project) -> Allocation | None:
-        return get_allocation(project, self.ea)
+    def get(self, project):
+        return get_allocation(project, self.by_project)
 
     def tick(self, allocation):
-        for i, a in enumerate(self.ea):
-            if a.id == allocation.id:
-                self.ea.pop(i)
-
-    def remaining(self) -> list:
-        return self.ea
+        self.tick_key(allocation.id)
 
 
-class AllocationUserTracker:
+class AllocationUserTracker(KeyedTracker):
     def __init__(self, allocationusers: list):
-        self.eau = [au for au in allocationusers]
+        super().__init__(
+            allocationusers, key=lambda au: (au.user_id, au.allocation_id)
+        )
 
     def tick(self, user, allocation):
-        for i, au in enumerate(self.eau):
-            if au.user_id == user.id and au.allocation.id == allocation.id:
-                self.eau.pop(i)
+        self.tick_key((user.id, allocation.id))
 
-    def remaining(self) -> list:
-        return self.eau
+
+# usernames and project names repeat across tens of thousands of records, so
+# they are interned and the records use __slots__ to keep manifests compact
 
 
 class ManifestUser:
+    __slots__ = ("username", "firstname", "lastname")
+
     def __init__(self, username: str, firstname: str, lastname: str):
-        self.username = username
-        self.firstname = firstname
-        self.lastname = lastname
+        self.username = sys.intern(username)
+        self.firstname = sys.intern(firstname)
+        self.lastname = sys.intern(lastname)
 
 
 class ManifestProject:
+    __slots__ = ("name", "owner", "users", "admins", "user_set", "admin_set")
+
     def __init__(self, name: str, owner: str, users: list[str], admins: list[str]):
-        self.name = name
-        self.owner = owner
-        self.users = users
-        self.admins = admins
+        self.name = sys.intern(name)
+        self.owner = sys.intern(owner)
+        self.users = [sys.intern(u) for u in users]
+        self.admins = [sys.intern(a) for a in admins]
+        self.user_set = frozenset(self.users)
+        self.admin_set = frozenset(self.admins)
 
 
 class Manifest:
     def __init__(self, users: list[ManifestUser], projects: list[ManifestProject]):
         self.users = users
         self.projects = projects
+        self.users_by_name = {}
+        for u in users:
+            self.users_by_name.setdefault(u.username, u)
+        self.projects_by_name = {}
+        for p in projects:
+            self.projects_by_name.setdefault(p.name, p)
+
+    def unknown_references(self) -> list[tuple[str, str, str]]:
+        # (project, "owner" or "user", username) for every owner or member
+        # that is not one of the manifest's users
+        unknown = []
+        for p in self.projects:
+            if p.owner not in self.users_by_name:
+                unknown.append((p.name, "owner", p.owner))
+            for username in p.users:
+                if username not in self.users_by_name:
+                    unknown.append((p.name, "user", username))
+        return unknown
 
     def to_json(self) -> str:
         return json.dumps(
@@ -225,69 +721,2014 @@ class Manifest:
 
     @staticmethod
     def load_from_file(path: str):
-        with open(path, "r") as f:
-            return Manifest.from_json(f.read())
+        # very large manifests are parsed incrementally when ijson is
+        # installed, so the raw document is never held in memory as a whole
+        try:
+            if ijson is not None and os.path.getsize(path) > MANIFEST_STREAM_THRESHOLD:
+                with open(path, "rb") as f:
+                    check_manifest_shape(f)
+                    f.seek(0)
+                    users = [
+                        manifest_user_from_dict(u) for u in ijson.items(f, "users.item")
+                    ]
+                    f.seek(0)
+                    projects = [
+                        manifest_project_from_dict(p)
+                        for p in ijson.items(f, "projects.item")
+                    ]
+                return Manifest(users, projects)
+            with open(path, "rb") as f:
+                data = json.load(f)
+        except OSError:
+            raise
+        except Exception as e:
+            raise Exception("Error parsing manifest json: " + str(e))
+        return Manifest.from_dict(data)
 
     @staticmethod
     def from_json(j: str):
         try:
             data = json.loads(j)
-            users = [
-                ManifestUser(
-                    username=u["username"],
-                    firstname=u["firstname"],
-                    lastname=u["lastname"],
-                )
-                for u in data["users"]
-            ]
-            projects = [
-                ManifestProject(
-                    name=p["name"],
-                    owner=p["owner"],
-                    users=p["users"],
-                    admins=p["admins"],
-                )
-                for p in data["projects"]
-            ]
+        except Exception as e:
+            raise Exception("Error parsing manifest json: " + str(e))
+        return Manifest.from_dict(data)
+
+    @staticmethod
+    def from_dict(data: dict):
+        try:
+            users = [manifest_user_from_dict(u) for u in data["users"]]
+            projects = [manifest_project_from_dict(p) for p in data["projects"]]
             return Manifest(users, projects)
         except Exception as e:
             raise Exception("Error parsing manifest json: " + str(e))
 
 
-app = Flask(__name__)
+def check_manifest_shape(f):
+    # ijson.items yields nothing for a missing key or a non-object root, so
+    # the streamed branch checks in one pass what from_dict gets from
+    # indexing: an object root with users and projects arrays
+    kinds = {}
+    events = ijson.parse(f)
+    for prefix, event, _ in events:
+        if prefix == "" and event != "start_map":
+            raise ValueError("manifest must be a JSON object")
+        break
+    for prefix, event, _ in events:
+        if prefix in ("users", "projects") and prefix not in kinds:
+            kinds[prefix] = event
+    for key in ("users", "projects"):
+        if key not in kinds:
+            raise KeyError(key)
+        if kinds[key] != "start_array":
+            raise ValueError(f"{key} must be an array")
+
+
+def manifest_user_from_dict(u: dict) -> ManifestUser:
+    return ManifestUser(
+        username=u["username"],
+        firstname=u["firstname"],
+        lastname=u["lastname"],
+    )
+
+
+def manifest_project_from_dict(p: dict) -> ManifestProject:
+    return ManifestProject(
+        name=p["name"],
+        owner=p["owner"],
+        users=p["users"],
+        admins=p["admins"],
+    )
+
+
+class ManifestTooLarge(Exception):
+    pass
+
+
+class ManifestDecodeError(Exception):
+    # the request body could not be read or decompressed, as opposed to a
+    # failure writing it to disk
+    pass
+
+
+def save_stream(stream, path: str, limit: int = MANIFEST_MAX_SIZE) -> int:
+    # copies a request body to disk without buffering it in memory
+    decode_errors = (OSError, EOFError, zlib.error)
+    if zstandard is not None:
+        decode_errors += (zstandard.ZstdError,)
+    size = 0
+    with open(path, "wb") as f:
+        while True:
+            try:
+                chunk = stream.read(MANIFEST_READ_CHUNK_SIZE)
+            except decode_errors as e:
+                raise ManifestDecodeError(str(e)) from e
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise ManifestTooLarge(f"manifest is larger than {limit} bytes")
+            f.write(chunk)
+    return size
+
+
+def decoded_stream(stream, content_encoding: str):
+    # wraps a request body so reads return decompressed bytes as they arrive
+    if content_encoding in ("", "identity"):
+        return stream
+    if content_encoding == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if content_encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise ValueError(f"unsupported Content-Encoding {content_encoding}")
+
+
+def load_msgpack_manifest(path: str) -> Manifest:
+    try:
+        with open(path, "rb") as f:
+            data = msgpack.Unpacker(
+                f, raw=False, max_buffer_size=MANIFEST_MAX_SIZE
+            ).unpack()
+    except Exception as e:
+        raise Exception("Error parsing manifest msgpack: " + str(e))
+    return Manifest.from_dict(data)
+
+
+def apply_manifest_operations(manifest: Manifest, operations: list) -> Manifest:
+    # returns a new manifest with the PATCH /manifest operations applied in
+    # order, leaving manifest itself untouched. raises ValueError naming the
+    # first operation that cannot be applied.
+    # duplicate names collapse to their first entry, as in the indexes
+    users = {}
+    for u in manifest.users:
+        users.setdefault(u.username, u)
+    projects = {}
+    for p in manifest.projects:
+        projects.setdefault(p.name, p)
+    if not isinstance(operations, list):
+        raise ValueError("operations must be a list")
+    for i, op in enumerate(operations):
+        try:
+            apply_manifest_operation(users, projects, op)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"operation {i}: {e}")
+    return Manifest(list(users.values()), list(projects.values()))
+
+
+def apply_manifest_operation(users: dict, projects: dict, op: dict):
+    kind = op["op"]
+    if kind == "add_user":
+        users[op["username"]] = ManifestUser(
+            op["username"], op["firstname"], op["lastname"]
+        )
+        return
+    if kind == "remove_user":
+        username = op["username"]
+        if username not in users:
+            raise ValueError(f"unknown user {username}")
+        owned = [p.name for p in projects.values() if p.owner == username]
+        if owned:
+            raise ValueError(f"user {username} owns {', '.join(owned)}")
+        del users[username]
+        for p in list(projects.values()):
+            # posted manifests can list admins that are not also members
+            if username in p.user_set or username in p.admin_set:
+                projects[p.name] = replace_members(p, remove=username)
+        return
+    if kind not in ("add_member", "remove_member", "add_admin", "remove_admin", "set_owner"):
+        raise ValueError(f"unknown op {kind}")
+    project = projects.get(op["project"])
+    if project is None:
+        raise ValueError(f"unknown project {op['project']}")
+    username = op["username"]
+    if kind.startswith("add") or kind == "set_owner":
+        if username not in users:
+            raise ValueError(f"unknown user {username}")
+    if kind == "add_member":
+        project = replace_members(project, add=username)
+    elif kind == "add_admin":
+        project = replace_members(project, add=username, admin=True)
+    elif kind == "remove_member":
+        if username == project.owner:
+            raise ValueError(f"user {username} owns {project.name}")
+        project = replace_members(project, remove=username)
+    elif kind == "remove_admin":
+        project = ManifestProject(
+            project.name,
+            project.owner,
+            project.users,
+            [a for a in project.admins if a != username],
+        )
+    else:
+        project = ManifestProject(
+            project.name, username, project.users, project.admins
+        )
+    projects[project.name] = project
+
+
+def replace_members(
+    project: ManifestProject, add: str = None, remove: str = None, admin: bool = False
+) -> ManifestProject:
+    # admins are always members too, and removing a member drops their admin
+    users = [u for u in project.users if u != remove]
+    admins = [a for a in project.admins if a != remove]
+    if add is not None and add not in project.user_set:
+        users.append(add)
+    if add is not None and admin and add not in project.admin_set:
+        admins.append(add)
+    return ManifestProject(project.name, project.owner, users, admins)
+
+
+class IngestScope:
+    # which entities an ingest may change. usernames and projects are the
+    # entities that changed; anything outside them is never deactivated.
+    # entities they reference (owners, members, projects of a changed user)
+    # are still created or activated if missing. requested scopes come from
+    # a POST /ingest body rather than a manifest delta.
+    def __init__(
+        self,
+        usernames=(),
+        projects=(),
+        everything: bool = False,
+        requested: bool = False,
+    ):
+        self.everything = everything
+        self.requested = requested
+        self.usernames = set(usernames)
+        self.projects = set(projects)
+        self.touched_usernames = set(self.usernames)
+        self.touched_projects = set(self.projects)
+
+    @staticmethod
+    def full():
+        return IngestScope(everything=True)
+
+    def is_empty(self) -> bool:
+        return not self.everything and not self.usernames and not self.projects
+
+    def expand(self, manifest: Manifest):
+        if self.everything:
+            return
+        for project in manifest.projects:
+            if project.name in self.projects or not self.usernames.isdisjoint(
+                project.user_set
+            ):
+                self.touched_projects.add(project.name)
+                self.touched_usernames.add(project.owner)
+            if project.name in self.projects:
+                self.touched_usernames.update(project.users)
+
+    def has_user(self, username: str) -> bool:
+        return self.everything or username in self.usernames
+
+    def has_project(self, title: str) -> bool:
+        return self.everything or title in self.projects
+
+    def has_membership(self, username: str, title: str) -> bool:
+        return self.everything or title in self.projects or username in self.usernames
+
+    def touches_user(self, username: str) -> bool:
+        return self.everything or username in self.touched_usernames
+
+    def touches_project(self, title: str) -> bool:
+        return self.everything or title in self.touched_projects
+
+    def to_dict(self) -> dict:
+        if self.everything:
+            return {"mode": "full"}
+        return {
+            "mode": "scoped" if self.requested else "incremental",
+            "users": sorted(self.usernames),
+            "projects": sorted(self.projects),
+        }
+
+
+def manifest_delta(old: Manifest, new: Manifest) -> IngestScope:
+    old_users = {u.username: (u.firstname, u.lastname) for u in old.users}
+    new_users = {u.username: (u.firstname, u.lastname) for u in new.users}
+    old_projects = {
+        p.name: (p.owner, p.user_set, p.admin_set)
+        for p in old.projects
+    }
+    new_projects = {
+        p.name: (p.owner, p.user_set, p.admin_set)
+        for p in new.projects
+    }
+    return IngestScope(
+        usernames=[
+            u
+            for u in old_users.keys() | new_users.keys()
+            if old_users.get(u) != new_users.get(u)
+        ],
+        projects=[
+            p
+            for p in old_projects.keys() | new_projects.keys()
+            if old_projects.get(p) != new_projects.get(p)
+        ],
+    )
+
+
+class IngestPlan:
+    # every change an ingest would make, computed from a Manifest and a
+    # ColdfrontModelManager snapshot without touching the database.
+    # rows that need creating are referenced by username / project title,
+    # existing rows by their snapshot row.
+    def __init__(self, cfmanager: ColdfrontModelManager):
+        self.cfmanager = cfmanager
+        self.errors = []
+        self.unknown_usernames = set()
+        self.users_to_create = []
+        self.users_to_activate = []
+        self.users_to_deactivate = []
+        self.projects_to_create = []
+        self.projects_to_update = []
+        self.projects_to_archive = []
+        self.resource_to_create = False
+        self.associations_to_create = []
+        self.association_role_changes = []
+        self.associations_to_activate = []
+        self.associations_to_deactivate = []
+        self.allocations_to_create = []
+        self.allocations_to_expire = []
+        self.allocation_users_to_create = []
+        self.allocation_users_to_activate = []
+        self.allocation_users_to_remove = []
+
+    def user_label(self, user_id: int) -> str:
+        return self.cfmanager.users_by_id[user_id].username
+
+    def project_label(self, project_id: int) -> str:
+        return self.cfmanager.projects_by_id[project_id].title
+
+    def allocation_label(self, allocation_id: int) -> str:
+        return self.project_label(
+            self.cfmanager.allocations_by_id[allocation_id].project_id
+        )
+
+    def association_label(self, a) -> str:
+        return f"{self.user_label(a.user_id)} -> {self.project_label(a.project_id)}"
+
+    def allocation_user_label(self, au) -> str:
+        return f"{self.user_label(au.user_id)} -> {self.allocation_label(au.allocation_id)}"
+
+    def sections(self) -> dict:
+        return {
+            "users": {
+                "create": [u.username for u in self.users_to_create],
+                "activate": [u.username for u in self.users_to_activate],
+                "deactivate": [u.username for u in self.users_to_deactivate],
+            },
+            "projects": {
+                "create": [p.name for p in self.projects_to_create],
+                "update": [p.title for p in self.projects_to_update],
+                "archive": [p.title for p in self.projects_to_archive],
+            },
+            "resources": {
+                "create": [RESOURCE_NAME] if self.resource_to_create else [],
+            },
+            "associations": {
+                "create": [
+                    f"{username} -> {title}"
+                    for username, title, _ in self.associations_to_create
+                ],
+                "role_change": [
+                    f"{self.association_label(a)}: {role}"
+                    for a, role in self.association_role_changes
+                ],
+                "activate": [
+                    self.association_label(a) for a in self.associations_to_activate
+                ],
+                "deactivate": [
+                    self.association_label(a) for a in self.associations_to_deactivate
+                ],
+            },
+            "allocations": {
+                "create": list(self.allocations_to_create),
+                "expire": [
+                    self.project_label(a.project_id) for a in self.allocations_to_expire
+                ],
+            },
+            "allocation_users": {
+                "create": [
+                    f"{username} -> {title}"
+                    for username, title in self.allocation_users_to_create
+                ],
+                "activate": [
+                    self.allocation_user_label(au)
+                    for au in self.allocation_users_to_activate
+                ],
+                "remove": [
+                    self.allocation_user_label(au)
+                    for au in self.allocation_users_to_remove
+                ],
+            },
+        }
+
+    def counts(self) -> dict:
+        # from the list lengths; label strings are only built for summary()
+        return {
+            "users": {
+                "create": len(self.users_to_create),
+                "activate": len(self.users_to_activate),
+                "deactivate": len(self.users_to_deactivate),
+            },
+            "projects": {
+                "create": len(self.projects_to_create),
+                "update": len(self.projects_to_update),
+                "archive": len(self.projects_to_archive),
+            },
+            "resources": {"create": int(self.resource_to_create)},
+            "associations": {
+                "create": len(self.associations_to_create),
+                "role_change": len(self.association_role_changes),
+                "activate": len(self.associations_to_activate),
+                "deactivate": len(self.associations_to_deactivate),
+            },
+            "allocations": {
+                "create": len(self.allocations_to_create),
+                "expire": len(self.allocations_to_expire),
+            },
+            "allocation_users": {
+                "create": len(self.allocation_users_to_create),
+                "activate": len(self.allocation_users_to_activate),
+                "remove": len(self.allocation_users_to_remove),
+            },
+        }
+
+    def phase_total(self, phase: str) -> int:
+        return sum(self.counts()[phase].values())
+
+    def summary(self) -> dict:
+        return {"counts": self.counts(), "plan": self.sections(), "errors": self.errors}
+
+
+def plan_ingest(
+    manifest: Manifest, cfmanager: ColdfrontModelManager, scope: IngestScope = None
+) -> IngestPlan:
+    if scope is None:
+        scope = IngestScope.full()
+    scope.expand(manifest)
+    plan = IngestPlan(cfmanager)
+    check_references(plan, manifest, cfmanager, scope)
+    plan_users(plan, manifest, cfmanager, scope)
+    plan_projects(plan, manifest, cfmanager, scope)
+    plan_associations(plan, manifest, cfmanager, scope)
+    plan_resources(plan, cfmanager)
+    plan_allocations(plan, manifest, cfmanager, scope)
+    plan_allocation_users(plan, manifest, cfmanager, scope)
+    return plan
+
+
+def check_references(
+    plan: IngestPlan, manifest: Manifest, cfmanager, scope: IngestScope
+):
+    # owners and members must be manifest users or already exist in coldfront.
+    # users outside the scope are never planned, or loaded in a scoped snapshot
+    for project, kind, username in manifest.unknown_references():
+        if not scope.touches_user(username):
+            continue
+        if cfmanager.get_user(username) is not None:
+            continue
+        plan.unknown_usernames.add(username)
+        plan.errors.append(f"unknown {kind} {username} in project {project}")
 
 
-@app.route("/manifest", methods=["POST"])
+def plan_users(plan: IngestPlan, manifest: Manifest, cfmanager, scope: IngestScope):
+    user_tracker = UserTracker(cfmanager.coldfront_users)
+    for user in manifest.users_by_name.values():
+        cfuser = cfmanager.get_user(user.username)
+        if cfuser is not None:
+            user_tracker.tick(cfuser)
+        if not scope.touches_user(user.username):
+            continue
+        if cfuser is None:
+            plan.users_to_create.append(user)
+            continue
+        if not cfuser.is_active:
+            plan.users_to_activate.append(cfuser)
+    for user in user_tracker.remaining():
+        if user.username == "admin":
+            # skip django admin
+            continue
+        if not user.is_active:
+            # skip deactivated users
+            continue
+        if not scope.has_user(user.username):
+            continue
+        plan.users_to_deactivate.append(user)
+
+
+def plan_projects(
+    plan: IngestPlan, manifest: Manifest, cfmanager, scope: IngestScope
+):
+    project_active_status = cfmanager.project_statuses["Active"]
+    project_archived_status = cfmanager.project_statuses["Archived"]
+    project_tracker = ProjectTracker(cfmanager.coldfront_projects)
+    for project in manifest.projects_by_name.values():
+        cfproject = cfmanager.get_project(project.name)
+        if cfproject is not None:
+            project_tracker.tick(cfproject)
+        if not scope.touches_project(project.name):
+            continue
+        if cfproject is None:
+            if project.owner in plan.unknown_usernames:
+                continue
+            plan.projects_to_create.append(project)
+            continue
+        if (
+            not cfproject.requires_review
+            or cfproject.status_id != project_active_status.id
+            or cfproject.description != "enter description"
+        ):
+            plan.projects_to_update.append(cfproject)
+    for project in project_tracker.remaining():
+        if project.status_id == project_archived_status.id:
+            continue
+        if not scope.has_project(project.title):
+            continue
+        plan.projects_to_archive.append(project)
+
+
+def plan_associations(
+    plan: IngestPlan, manifest: Manifest, cfmanager, scope: IngestScope
+):
+    cf_status_active = cfmanager.project_user_statuses["Active"]
+    cf_status_inactive = cfmanager.project_user_statuses["Removed"]
+    association_tracker = ProjectUserTracker(cfmanager.coldfront_associations)
+    pending = set()
+    for manifest_project in manifest.projects:
+        if not scope.touches_project(manifest_project.name):
+            continue
+        cf_project = cfmanager.get_project(manifest_project.name)
+        for username in manifest_project.users:
+            if manifest_project.owner == username:
+                # skip PIs
+                continue
+            if not scope.has_membership(username, manifest_project.name):
+                continue
+            if username in plan.unknown_usernames:
+                continue
+            role = "Manager" if username in manifest_project.admin_set else "User"
+            cf_user = cfmanager.get_user(username)
+            assoc = None
+            if cf_user is not None and cf_project is not None:
+                assoc = cfmanager.get_association(cf_user, cf_project)
+            if assoc is None:
+                if (username, manifest_project.name) not in pending:
+                    pending.add((username, manifest_project.name))
+                    plan.associations_to_create.append(
+                        (username, manifest_project.name, role)
+                    )
+                continue
+            if assoc.role_id != cfmanager.project_user_roles[role].id:
+                plan.association_role_changes.append((assoc, role))
+            if assoc.status_id != cf_status_active.id:
+                plan.associations_to_activate.append(assoc)
+            association_tracker.tick(cf_user, cf_project)
+    for association in association_tracker.remaining():
+        if association.status_id == cf_status_inactive.id:
+            continue
+        if not scope.has_membership(
+            plan.user_label(association.user_id),
+            plan.project_label(association.project_id),
+        ):
+            continue
+        plan.associations_to_deactivate.append(association)
+
+
+def plan_resources(plan: IngestPlan, cfmanager):
+    plan.resource_to_create = RESOURCE_NAME not in cfmanager.resources_by_name
+
+
+def plan_allocations(
+    plan: IngestPlan, manifest: Manifest, cfmanager, scope: IngestScope
+):
+    cf_alloc_status_expired = cfmanager.allocation_statuses["Expired"]
+    allocation_tracker = AllocationTracker(cfmanager.coldfront_allocations)
+    for project in manifest.projects_by_name.values():
+        cf_project = cfmanager.get_project(project.name)
+        cf_allocation = None
+        if cf_project is not None:
+            cf_allocation = allocation_tracker.get(cf_project)
+        if cf_allocation is not None:
+            allocation_tracker.tick(cf_allocation)
+        elif scope.touches_project(project.name):
+            plan.allocations_to_create.append(project.name)
+    for allocation in allocation_tracker.remaining():
+        if allocation.status_id == cf_alloc_status_expired.id:
+            continue
+        if not scope.has_project(plan.project_label(allocation.project_id)):
+            continue
+        plan.allocations_to_expire.append(allocation)
+
+
+def plan_allocation_users(
+    plan: IngestPlan, manifest: Manifest, cfmanager, scope: IngestScope
+):
+    cf_alloc_user_status_active = cfmanager.allocation_user_statuses["Active"]
+    cf_alloc_user_status_removed = cfmanager.allocation_user_statuses["Removed"]
+    allocation_user_tracker = AllocationUserTracker(
+        cfmanager.coldfront_allocation_users
+    )
+    pending = set()
+    for project in manifest.projects:
+        if not scope.touches_project(project.name):
+            continue
+        cf_project = cfmanager.get_project(project.name)
+        cf_allocation = None
+        if cf_project is not None:
+            cf_allocation = cfmanager.get_allocation(cf_project)
+        for username in project.users:
+            if project.owner == username:
+                # skip PIs
+                continue
+            if not scope.has_membership(username, project.name):
+                continue
+            if username in plan.unknown_usernames:
+                continue
+            cf_user = cfmanager.get_user(username)
+            allocation_user = None
+            if cf_user is not None and cf_allocation is not None:
+                allocation_user = cfmanager.get_allocation_user(cf_user, cf_allocation)
+            if allocation_user is None:
+                if (username, project.name) not in pending:
+                    pending.add((username, project.name))
+                    plan.allocation_users_to_create.append((username, project.name))
+                continue
+            if allocation_user.status_id != cf_alloc_user_status_active.id:
+                plan.allocation_users_to_activate.append(allocation_user)
+            allocation_user_tracker.tick(cf_user, cf_allocation)
+    for allocation_user in allocation_user_tracker.remaining():
+        if allocation_user.status_id == cf_alloc_user_status_removed.id:
+            continue
+        if not scope.has_membership(
+            plan.user_label(allocation_user.user_id),
+            plan.allocation_label(allocation_user.allocation_id),
+        ):
+            continue
+        plan.allocation_users_to_remove.append(allocation_user)
+
+
+def apply_plan(plan: IngestPlan, cfmanager: ColdfrontModelManager, job):
+    # users, projects and the resource are shared by every project, so they
+    # are written before the per-project phases that may run in parallel.
+    # a phase is only checkpointed as completed if none of its rows failed.
+    for phase, apply in (
+        ("users", apply_users),
+        ("projects", apply_projects),
+        ("resources", apply_resources),
+        ("associations", apply_associations),
+        ("allocations", apply_allocations),
+        ("allocation_users", apply_allocation_users),
+    ):
+        if phase in job.completed_phases:
+            logging.info(f"skipping {phase}, completed before ingest job {job.resumed} stopped")
+            continue
+        errors = len(job.errors)
+        apply(plan, cfmanager, job)
+        if len(job.errors) == errors:
+            job.complete_phase(phase)
+
+
+def apply_in_chunks(
+    job, action: str, items: list, apply_chunk, describe, project_of=None
+) -> int:
+    # rows of different projects never overlap, so with INGEST_CONCURRENCY
+    # above 1 the items are split by project across a pool of threads, each
+    # with its own db connection. errors are merged in partition order so
+    # the job reports them the same way on every run.
+    if project_of is None or INGEST_CONCURRENCY <= 1:
+        return apply_chunks(job, action, items, apply_chunk, describe, job.errors)
+    partitions = partition_by_project(items, project_of, INGEST_CONCURRENCY)
+    if len(partitions) <= 1:
+        return apply_chunks(job, action, items, apply_chunk, describe, job.errors)
+
+    def run_partition(partition):
+        errors = []
+        try:
+            with connection.execute_wrapper(job.query_wrapper):
+                applied = apply_chunks(
+                    job, action, partition, apply_chunk, describe, errors
+                )
+        finally:
+            connection.close()
+        return applied, errors
+
+    applied = 0
+    with ThreadPoolExecutor(
+        max_workers=len(partitions), thread_name_prefix="ingest-apply"
+    ) as pool:
+        for n, errors in pool.map(run_partition, partitions):
+            applied += n
+            job.errors.extend(errors)
+    return applied
+
+
+def partition_by_project(items: list, project_of, n: int) -> list[list]:
+    # whole projects go to the least loaded partition, in first-seen order
+    groups = defaultdict(list)
+    for item in items:
+        groups[project_of(item)].append(item)
+    partitions = [[] for _ in range(min(n, len(groups)))]
+    for group in groups.values():
+        min(partitions, key=len).extend(group)
+    return partitions
+
+
+def apply_chunks(
+    job, action: str, items: list, apply_chunk, describe, errors: list
+) -> int:
+    # each chunk commits in one transaction. if a chunk fails it is rolled
+    # back and retried row by row, each row in its own savepoint, so a bad
+    # row is recorded in errors without losing the rest of the chunk.
+    # per-row messages are only built when debug logging is enabled.
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    applied = 0
+    for chunk in chunked(items, INGEST_CHUNK_SIZE):
+        if debug:
+            for item in chunk:
+                logging.debug("%s %s", action, describe(item))
+        try:
+            with transaction.atomic():
+                apply_chunk(chunk)
+            applied += len(chunk)
+        except Exception as e:
+            logging.warning("error %s chunk, retrying row by row: %s", action, e)
+            with transaction.atomic():
+                for item in chunk:
+                    try:
+                        with transaction.atomic():
+                            apply_chunk([item])
+                        applied += 1
+                    except Exception as e:
+                        logging.error(f"error {action} {describe(item)}: {e}")
+                        errors.append(f"Error {action} {describe(item)}: {e}")
+        job.advance(len(chunk))
+        job.commit_batch()
+    return applied
+
+
+def apply_users(plan: IngestPlan, cfmanager: ColdfrontModelManager, job):
+    job.start_phase("users", plan.phase_total("users"))
+    logging.debug("syncing users")
+
+    def create(users):
+        created = create_users(
+            [
+                User(
+                    email=f"{user.username}@{DOMAIN}",
+                    username=user.username,
+                    first_name=user.firstname,
+                    last_name=user.lastname,
+                    is_active=True,
+                    is_staff=False,
+                    is_superuser=False,
+                )
+                for user in users
+            ]
+        )
+        write_through(
+            cfmanager,
+            job,
+            "user",
+            "created",
+            None,
+            rows_from(UserRow, created),
+        )
+
+    def activate(users):
+        update_by_ids(User, [u.id for u in users], is_active=True)
+        write_through(
+            cfmanager,
+            job,
+            "user",
+            "updated",
+            users,
+            replace_rows(users, is_active=True),
+        )
+
+    def deactivate(users):
+        update_by_ids(User, [u.id for u in users], is_active=False)
+        write_through(
+            cfmanager,
+            job,
+            "user",
+            "deactivated",
+            users,
+            replace_rows(users, is_active=False),
+        )
+
+    n = apply_in_chunks(
+        job, "creating user", plan.users_to_create, create, lambda u: u.username
+    )
+    logging.debug("created %d users", n)
+    job.record_rows("user", "created", n)
+    n = apply_in_chunks(
+        job, "activating user", plan.users_to_activate, activate, lambda u: u.username
+    )
+    logging.debug("activated %d users", n)
+    job.record_rows("user", "updated", n)
+    n = apply_in_chunks(
+        job,
+        "deactivating user",
+        plan.users_to_deactivate,
+        deactivate,
+        lambda u: u.username,
+    )
+    logging.debug("deactivated %d users", n)
+    job.record_rows("user", "deactivated", n)
+    logging.debug("users synced successfully")
+
+
+def apply_projects(plan: IngestPlan, cfmanager: ColdfrontModelManager, job):
+    job.start_phase("projects", plan.phase_total("projects"))
+    logging.debug("syncing projects")
+    project_active_status = cfmanager.project_statuses["Active"]
+    project_archived_status = cfmanager.project_statuses["Archived"]
+
+    def create(projects):
+        created = bulk_create(
+            Project,
+            [
+                Project(
+                    title=project.name,
+                    pi_id=cfmanager.get_user(project.owner).id,
+                    description="enter description",
+                    status=project_active_status,
+                    requires_review=True,
+                    force_review=False,
+                )
+                for project in projects
+            ],
+        )
+        fetch_created_ids(Project, created, "title")
+        write_through(
+            cfmanager,
+            job,
+            "project",
+            "created",
+            None,
+            rows_from(ProjectRow, created),
+        )
+
+    def update(projects):
+        update_by_ids(
+            Project,
+            [p.id for p in projects],
+            requires_review=True,
+            status=project_active_status,
+            description="enter description",
+        )
+        write_through(
+            cfmanager,
+            job,
+            "project",
+            "updated",
+            projects,
+            replace_rows(
+                projects,
+                requires_review=True,
+                status_id=project_active_status.id,
+                description="enter description",
+            ),
+        )
+
+    def archive(projects):
+        update_by_ids(Project, [p.id for p in projects], status=project_archived_status)
+        write_through(
+            cfmanager,
+            job,
+            "project",
+            "deactivated",
+            projects,
+            replace_rows(projects, status_id=project_archived_status.id),
+        )
+
+    n = apply_in_chunks(
+        job, "creating project", plan.projects_to_create, create, lambda p: p.name
+    )
+    logging.debug("created %d projects", n)
+    job.record_rows("project", "created", n)
+    n = apply_in_chunks(
+        job, "updating project", plan.projects_to_update, update, lambda p: p.title
+    )
+    logging.debug("updated %d projects", n)
+    job.record_rows("project", "updated", n)
+    n = apply_in_chunks(
+        job, "archiving project", plan.projects_to_archive, archive, lambda p: p.title
+    )
+    logging.debug("archived %d projects", n)
+    job.record_rows("project", "deactivated", n)
+    logging.debug("projects synced successfully")
+
+
+def apply_associations(plan: IngestPlan, cfmanager: ColdfrontModelManager, job):
+    job.start_phase("associations", plan.phase_total("associations"))
+    logging.debug("syncing associations")
+    cf_status_active = cfmanager.project_user_statuses["Active"]
+    cf_status_inactive = cfmanager.project_user_statuses["Removed"]
+
+    def create(associations):
+        created = bulk_create(
+            ProjectUser,
+            [
+                ProjectUser(
+                    project_id=cfmanager.get_project(title).id,
+                    user_id=cfmanager.get_user(username).id,
+                    status=cf_status_active,
+                    role=cfmanager.project_user_roles[role],
+                )
+                for username, title, role in associations
+            ],
+        )
+        fetch_created_ids(ProjectUser, created, "user_id", "project_id")
+        write_through(
+            cfmanager,
+            job,
+            "project_user",
+            "created",
+            None,
+            rows_from(AssociationRow, created),
+        )
+
+    def update(associations):
+        bulk_update(ProjectUser, associations, ["role", "status"])
+        write_through(
+            cfmanager,
+            job,
+            "project_user",
+            "updated",
+            [original_associations[a.id] for a in associations],
+            rows_from(AssociationRow, associations),
+        )
+
+    def deactivate(associations):
+        update_by_ids(
+            ProjectUser, [a.id for a in associations], status=cf_status_inactive
+        )
+        write_through(
+            cfmanager,
+            job,
+            "project_user",
+            "deactivated",
+            associations,
+            replace_rows(associations, status_id=cf_status_inactive.id),
+        )
+
+    n = apply_in_chunks(
+        job,
+        "creating association",
+        plan.associations_to_create,
+        create,
+        lambda a: f"{a[0]} -> {a[1]}",
+        lambda a: a[1],
+    )
+    logging.debug("created %d associations", n)
+    job.record_rows("project_user", "created", n)
+    # role and status vary per row, so these are written with bulk_update
+    # from instances holding just the id and the two columns
+    updated_associations = {}
+    original_associations = {}
+
+    def updated_association(assoc) -> ProjectUser:
+        if assoc.id not in updated_associations:
+            original_associations[assoc.id] = assoc
+            updated_associations[assoc.id] = ProjectUser(
+                id=assoc.id,
+                user_id=assoc.user_id,
+                project_id=assoc.project_id,
+                role_id=assoc.role_id,
+                status_id=assoc.status_id,
+            )
+        return updated_associations[assoc.id]
+
+    for assoc, role in plan.association_role_changes:
+        updated_association(assoc).role_id = cfmanager.project_user_roles[role].id
+    for assoc in plan.associations_to_activate:
+        updated_association(assoc).status_id = cf_status_active.id
+    # an association can change role and status at once but is written once
+    job.advance(
+        len(plan.association_role_changes)
+        + len(plan.associations_to_activate)
+        - len(updated_associations)
+    )
+    n = apply_in_chunks(
+        job,
+        "updating association",
+        list(updated_associations.values()),
+        update,
+        plan.association_label,
+        lambda a: a.project_id,
+    )
+    logging.debug("updated %d associations", n)
+    job.record_rows("project_user", "updated", n)
+    n = apply_in_chunks(
+        job,
+        "deactivating association",
+        plan.associations_to_deactivate,
+        deactivate,
+        plan.association_label,
+        lambda a: a.project_id,
+    )
+    logging.debug("deactivated %d associations", n)
+    job.record_rows("project_user", "deactivated", n)
+    logging.debug("associations synced successfully")
+
+
+def apply_resources(plan: IngestPlan, cfmanager: ColdfrontModelManager, job):
+    job.start_phase("resources", plan.phase_total("resources"))
+    logging.debug("syncing resources")
+
+    def create(names):
+        cf_resource_type = ResourceType.objects.get(name="Cluster")
+        for name in names:
+            resource = Resource.objects.create(
+                name=name,
+                description=RESOURCE_DESCRIPTION,
+                is_allocatable=True,
+                is_available=True,
+                is_public=True,
+                requires_payment=False,
+                resource_type=cf_resource_type,
+            )
+            write_through(
+                cfmanager,
+                job,
+                "resource",
+                "created",
+                None,
+                rows_from(ResourceRow, [resource]),
+            )
+
+    if plan.resource_to_create:
+        logging.debug("creating resource %s", RESOURCE_NAME)
+        if apply_in_chunks(
+            job, "creating resource", [RESOURCE_NAME], create, lambda r: r
+        ):
+            logging.debug("created resource %s", RESOURCE_NAME)
+            job.record_rows("resource", "created", 1)
+    logging.debug("resources synced successfully")
+
+
+def apply_allocations(plan: IngestPlan, cfmanager: ColdfrontModelManager, job):
+    job.start_phase("allocations", plan.phase_total("allocations"))
+    logging.debug("syncing allocations")
+    cluster_resource = cfmanager.resources_by_name.get(RESOURCE_NAME)
+    cf_alloc_status_active = cfmanager.allocation_statuses["Active"]
+    cf_alloc_status_expired = cfmanager.allocation_statuses["Expired"]
+
+    def create(titles):
+        if cluster_resource is None:
+            raise Exception(f"resource {RESOURCE_NAME} does not exist")
+        created = []
+        for title in titles:
+            cf_allocation = Allocation.objects.create(
+                project_id=cfmanager.get_project(title).id,
+                start_date=ALLOCATION_START_DATE,
+                end_date=ALLOCATION_END_DATE,
+                status=cf_alloc_status_active,
+            )
+            cf_allocation.resources.set([cluster_resource.id])
+            created.append(cf_allocation)
+        write_through(
+            cfmanager,
+            job,
+            "allocation",
+            "created",
+            None,
+            rows_from(AllocationRow, created),
+        )
+
+    def expire(allocations):
+        update_by_ids(
+            Allocation, [a.id for a in allocations], status=cf_alloc_status_expired
+        )
+        write_through(
+            cfmanager,
+            job,
+            "allocation",
+            "deactivated",
+            allocations,
+            replace_rows(allocations, status_id=cf_alloc_status_expired.id),
+        )
+
+    n = apply_in_chunks(
+        job,
+        "creating allocation",
+        plan.allocations_to_create,
+        create,
+        lambda t: t,
+        lambda t: t,
+    )
+    logging.debug("created %d allocations", n)
+    job.record_rows("allocation", "created", n)
+    n = apply_in_chunks(
+        job,
+        "deactivating allocation",
+        plan.allocations_to_expire,
+        expire,
+        lambda a: plan.project_label(a.project_id),
+        lambda a: a.project_id,
+    )
+    logging.debug("deactivated %d allocations", n)
+    job.record_rows("allocation", "deactivated", n)
+    logging.debug("allocations synced successfully")
+
+
+def apply_allocation_users(plan: IngestPlan, cfmanager: ColdfrontModelManager, job):
+    job.start_phase("allocation_users", plan.phase_total("allocation_users"))
+    logging.debug("syncing allocation users")
+    cf_alloc_user_status_active = cfmanager.allocation_user_statuses["Active"]
+    cf_alloc_user_status_removed = cfmanager.allocation_user_statuses["Removed"]
+
+    def create(allocation_users):
+        created = bulk_create(
+            AllocationUser,
+            [
+                AllocationUser(
+                    allocation_id=cfmanager.get_allocation(
+                        cfmanager.get_project(title)
+                    ).id,
+                    user_id=cfmanager.get_user(username).id,
+                    status=cf_alloc_user_status_active,
+                )
+                for username, title in allocation_users
+            ],
+        )
+        fetch_created_ids(AllocationUser, created, "user_id", "allocation_id")
+        write_through(
+            cfmanager,
+            job,
+            "allocation_user",
+            "created",
+            None,
+            rows_from(AllocationUserRow, created),
+        )
+
+    def activate(allocation_users):
+        update_by_ids(
+            AllocationUser,
+            [au.id for au in allocation_users],
+            status=cf_alloc_user_status_active,
+        )
+        write_through(
+            cfmanager,
+            job,
+            "allocation_user",
+            "updated",
+            allocation_users,
+            replace_rows(allocation_users, status_id=cf_alloc_user_status_active.id),
+        )
+
+    def remove(allocation_users):
+        update_by_ids(
+            AllocationUser,
+            [au.id for au in allocation_users],
+            status=cf_alloc_user_status_removed,
+        )
+        write_through(
+            cfmanager,
+            job,
+            "allocation_user",
+            "deactivated",
+            allocation_users,
+            replace_rows(allocation_users, status_id=cf_alloc_user_status_removed.id),
+        )
+
+    n = apply_in_chunks(
+        job,
+        "creating allocation user",
+        plan.allocation_users_to_create,
+        create,
+        lambda au: f"{au[0]} -> {au[1]}",
+        lambda au: au[1],
+    )
+    logging.debug("created %d allocation users", n)
+    job.record_rows("allocation_user", "created", n)
+    n = apply_in_chunks(
+        job,
+        "activating allocation user",
+        plan.allocation_users_to_activate,
+        activate,
+        plan.allocation_user_label,
+        lambda au: au.allocation_id,
+    )
+    logging.debug("activated %d allocation users", n)
+    job.record_rows("allocation_user", "updated", n)
+    n = apply_in_chunks(
+        job,
+        "removing allocation user",
+        plan.allocation_users_to_remove,
+        remove,
+        plan.allocation_user_label,
+        lambda au: au.allocation_id,
+    )
+    logging.debug("removed %d allocation users", n)
+    job.record_rows("allocation_user", "deactivated", n)
+    logging.debug("allocation users synced successfully")
+
+
+class IngestJob:
+    def __init__(self, full: bool = False, scope: IngestScope = None):
+        self.id = uuid.uuid4().hex
+        self.full = full
+        self.scope = scope
+        self.content_hash = None
+        self.state = "queued"
+        self.phase = None
+        self.processed = 0
+        self.total = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.status_code = None
+        self.errors = []
+        # per-phase seconds, processed rows, db queries and query seconds
+        self.phases = {}
+        self.phase_started = None
+        # (model, action) -> rows written
+        self.rows = defaultdict(int)
+        # phase -> "model_action" -> rows written, for the phase summaries
+        self.phase_rows = {}
+        self.saved_at = 0.0
+        # checkpointed progress, see IngestCheckpoint. checkpoint_scope is
+        # set once run_ingest has resolved the scope, and cleared when the
+        # ingest no longer needs a checkpoint
+        self.checkpoint_scope = None
+        self.completed_phases = []
+        self.batches = 0
+        self.resumed = None
+        # progress and query stats are updated from the apply worker pool
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.state = "running"
+        self.started_at = time.time()
+        self.save()
+
+    def start_phase(self, phase: str, total: int = 0):
+        self.end_phase()
+        self.phase = phase
+        self.processed = 0
+        self.total = total
+        self.phase_started = time.perf_counter()
+        self.phase_stats(phase)
+        self.batches = 0
+        self.save()
+        self.save_checkpoint()
+
+    def end_phase(self):
+        if self.phase_started is None:
+            return
+        stats = self.phase_stats(self.phase)
+        stats["seconds"] += time.perf_counter() - self.phase_started
+        stats["processed"] = self.processed
+        self.phase_started = None
+        self.save_checkpoint()
+        # one summary per phase in place of per-row messages
+        rows = self.phase_rows.get(self.phase, {})
+        logging.info(
+            "ingest %s phase %s: %d processed in %.3fs, %d queries in %.3fs%s",
+            self.id,
+            self.phase,
+            self.processed,
+            stats["seconds"],
+            stats["queries"],
+            stats["query_seconds"],
+            "".join(f", {k} {v}" for k, v in rows.items() if v),
+            extra={
+                "fields": {
+                    "job": self.id,
+                    "phase": self.phase,
+                    **stats,
+                    "rows": rows,
+                }
+            },
+        )
+
+    def phase_stats(self, phase: str) -> dict:
+        return self.phases.setdefault(
+            phase, {"seconds": 0.0, "processed": 0, "queries": 0, "query_seconds": 0.0}
+        )
+
+    def advance(self, n: int):
+        with self.lock:
+            self.processed += n
+            if time.time() - self.saved_at >= INGEST_JOB_SAVE_INTERVAL:
+                self.save()
+
+    def commit_batch(self):
+        # a small file per chunk of INGEST_CHUNK_SIZE rows, written every
+        # time so the checkpoint always has the last committed batch
+        with self.lock:
+            self.batches += 1
+            self.save_checkpoint()
+
+    def complete_phase(self, phase: str):
+        self.completed_phases.append(phase)
+        self.save_checkpoint()
+
+    def resume(self, checkpoint: dict):
+        self.resumed = checkpoint["job"]
+        self.completed_phases = list(checkpoint["phases"])
+        logging.info(
+            f"resuming ingest job {self.resumed}: {len(self.completed_phases)} "
+            f"phases completed, {checkpoint['batches']} batches committed in "
+            f"phase {checkpoint['phase']}"
+        )
+
+    def save_checkpoint(self):
+        if self.checkpoint_scope is None:
+            return
+        try:
+            ingest_checkpoint.save(self)
+        except OSError as e:
+            logging.error(f"error saving ingest checkpoint: {e}")
+
+    def clear_checkpoint(self):
+        self.checkpoint_scope = None
+        ingest_checkpoint.clear()
+
+    def record_rows(self, model: str, action: str, n: int):
+        self.rows[(model, action)] += n
+        phase_rows = self.phase_rows.setdefault(self.phase, {})
+        phase_rows[f"{model}_{action}"] = phase_rows.get(f"{model}_{action}", 0) + n
+
+    def query_wrapper(self, execute, sql, params, many, context):
+        # installed with connection.execute_wrapper for the whole ingest, and
+        # on each apply worker's connection
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                stats = self.phase_stats(self.phase or "loading")
+                stats["queries"] += 1
+                stats["query_seconds"] += time.perf_counter() - start
+
+    def finish(self, result: dict, status_code: int):
+        self.end_phase()
+        self.result = result
+        self.status_code = status_code
+        self.state = "finished" if status_code < 400 else "failed"
+        self.finished_at = time.time()
+        self.save()
+
+    def save(self):
+        # job status is kept on disk so any server process can report it
+        self.saved_at = time.time()
+        try:
+            tmp_path = f"{JOBS_DIR}/{self.id}.json.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.to_dict(), f)
+            os.replace(tmp_path, f"{JOBS_DIR}/{self.id}.json")
+        except OSError as e:
+            logging.error(f"error saving ingest job {self.id}: {e}")
+
+    @staticmethod
+    def load(job_id: str) -> dict | None:
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(f"{JOBS_DIR}/{job_id}.json", "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self) -> dict:
+        return {
+            "job": self.id,
+            "state": self.state,
+            "full": self.full,
+            "hash": self.content_hash,
+            "scope": self.scope.to_dict() if self.scope is not None else None,
+            "phase": self.phase,
+            "processed": self.processed,
+            "total": self.total,
+            "elapsed": round(self.elapsed(), 3),
+            "errors": len(self.errors),
+            "resumed": self.resumed,
+            "phases": {
+                phase: {k: round(v, 3) for k, v in stats.items()}
+                for phase, stats in self.phases.items()
+            },
+            "result": self.result,
+        }
+
+
+class IngestCheckpoint:
+    # progress of the last ingest that did not finish cleanly: its manifest
+    # hash and resolved scope, the phases it completed and the batches
+    # committed in the phase it was in. an ingest of the same hash and scope
+    # skips the completed phases. within the interrupted phase, replanning
+    # against the committed rows already leaves out the batches that made
+    # it, so the batch count is only reported.
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self, h: str) -> dict | None:
+        try:
+            with open(self.path, "r") as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.error(f"error loading ingest checkpoint: {e}")
+            return None
+        if checkpoint.get("hash") != h:
+            logging.info("manifest changed since the last checkpoint, starting over")
+            return None
+        return checkpoint
+
+    def save(self, job):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "job": job.id,
+                    "hash": job.content_hash,
+                    "scope": job.checkpoint_scope,
+                    "phases": job.completed_phases,
+                    "phase": job.phase,
+                    "batches": job.batches,
+                    "time": time.time(),
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        remove_file(self.path)
+
+
+ingest_checkpoint = IngestCheckpoint(f"{RUN_DIR}/ingest_checkpoint.json")
+
+
+class IngestLock:
+    # cross-process ingest lock. flock is atomic and the kernel drops it when
+    # the holding process dies, so a crashed ingest never leaves it stuck.
+    # the holder writes its pid and job id to a separate file for other
+    # workers to report; they never lock the lock file themselves, since
+    # even a brief shared lock would make a concurrent acquire fail.
+    def __init__(self, path: str):
+        self.path = path
+        self.holder_path = f"{path}.holder"
+        self.fd = None
+
+    def acquire(self, holder: str) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self.fd = fd
+        tmp_path = f"{self.holder_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(f"{os.getpid()} {holder}")
+            os.replace(tmp_path, self.holder_path)
+        except OSError as e:
+            logging.error(f"error writing ingest lock holder: {e}")
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+        remove_file(self.holder_path)
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+    def holder(self) -> str | None:
+        # job id of the ingest holding the lock in any process, or None. a
+        # holder file left by a process that died no longer counts.
+        try:
+            with open(self.holder_path, "r") as f:
+                pid, _, job_id = f.read().partition(" ")
+            os.kill(int(pid), 0)
+        except (FileNotFoundError, ProcessLookupError, ValueError):
+            return None
+        except PermissionError:
+            # the process exists but belongs to another user
+            pass
+        return job_id or "unknown"
+
+
+class IngestQueue:
+    # runs ingest jobs on a background worker thread. a job holds the
+    # ingest lock from submit until it finishes, so only one ingest is ever
+    # queued or running across all server processes.
+    def __init__(self):
+        self.ingest_lock = IngestLock(f"{RUN_DIR}/ingest.lock")
+        self.after_fork()
+
+    def after_fork(self):
+        # threads do not survive fork, so each worker process starts clean
+        self.jobs = {}
+        self.current = None
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.worker = None
+        self.ingest_lock.fd = None
+
+    def ensure_worker(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(
+                target=self.run, name="ingest-worker", daemon=True
+            )
+            self.worker.start()
+
+    def get(self, job_id: str) -> dict | None:
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        # jobs run by other server processes are only known from disk
+        return IngestJob.load(job_id)
+
+    def holder(self) -> str | None:
+        current = self.current
+        if current is not None:
+            return current.id
+        return self.ingest_lock.holder()
+
+    def submit(self, full: bool = False, scope: IngestScope = None) -> tuple[str, bool]:
+        # returns the queued job id, or the locked one if an ingest is locked
+        with self.lock:
+            if self.current is not None:
+                return self.current.id, False
+            job = IngestJob(full=full, scope=scope)
+            if not self.ingest_lock.acquire(job.id):
+                return self.ingest_lock.holder() or "unknown", False
+            self.current = job
+            self.jobs[job.id] = job
+            # forget the oldest jobs, dicts keep insertion order
+            while len(self.jobs) > INGEST_JOB_HISTORY:
+                del self.jobs[next(iter(self.jobs))]
+            job.save()
+            self.ensure_worker()
+        self.queue.put(job)
+        return job.id, True
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            job.start()
+            logging.info(f"ingest job {job.id} started")
+            try:
+                with connection.execute_wrapper(job.query_wrapper):
+                    result, status_code = run_ingest(job)
+            except Exception as e:
+                logging.error(f"ingest job {job.id} failed: {e}")
+                result, status_code = {"status": f"Error running ingest: {e}"}, 500
+            finally:
+                # the worker thread holds its own db connection
+                connection.close()
+            job.finish(result, status_code)
+            metrics.record_ingest(job)
+            prune_job_files()
+            logging.info(f"ingest job {job.id} {job.state} in {job.elapsed():.1f}s")
+            with self.lock:
+                self.ingest_lock.release()
+                self.current = None
+            auto_ingest.ingest_finished()
+
+
+class AutoIngest:
+    # debounces ingests queued by manifest uploads. each new hash restarts
+    # the quiet period, so a burst of uploads becomes one ingest of the
+    # newest manifest. if an ingest is running when the period ends, one
+    # follow-up is queued as soon as it finishes.
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.after_fork()
+
+    def after_fork(self):
+        self.lock = threading.Lock()
+        self.timer = None
+        self.waiting = False
+
+    def schedule(self):
+        with self.lock:
+            self.waiting = False
+            self.start_timer(self.delay)
+
+    def start_timer(self, delay: float):
+        # called with self.lock held
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = threading.Timer(delay, self.fire)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def fire(self):
+        with self.lock:
+            if self.timer is not threading.current_thread():
+                # cancelled or rescheduled after this timer went off
+                return
+            self.timer = None
+            self.waiting = False
+        if get_applied_hash() == get_current_hash():
+            logging.info("auto ingest skipped, manifest already applied")
+            return
+        job_id, queued = ingest_queue.submit()
+        if queued:
+            logging.info(f"auto ingest queued job {job_id}")
+            return
+        with self.lock:
+            if self.timer is not None:
+                return
+            # ingest_finished wakes us when the ingest runs in this process;
+            # one running in another worker is only noticed by polling
+            logging.info(f"auto ingest waiting for ingest job {job_id}")
+            self.waiting = True
+            self.start_timer(AUTO_INGEST_RETRY_INTERVAL)
+
+    def ingest_finished(self):
+        with self.lock:
+            if not self.waiting:
+                return
+            self.start_timer(0)
+
+
+def prune_job_files():
+    try:
+        paths = [
+            os.path.join(JOBS_DIR, name)
+            for name in os.listdir(JOBS_DIR)
+            if name.endswith(".json")
+        ]
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:-INGEST_JOB_HISTORY]:
+            remove_file(path)
+    except OSError as e:
+        logging.error(f"error pruning ingest job files: {e}")
+
+
+def change_records(cfmanager, job, entity: str, action: str, old_rows, new_rows):
+    now = time.time()
+    records = []
+    for i, row in enumerate(new_rows):
+        records.append(
+            {
+                "job": job.id,
+                "hash": job.content_hash,
+                "time": now,
+                "entity": entity,
+                "action": action,
+                "key": cfmanager.change_key(entity, row),
+                "old": (
+                    cfmanager.change_state(entity, old_rows[i])
+                    if old_rows is not None
+                    else None
+                ),
+                "new": cfmanager.change_state(entity, row),
+            }
+        )
+    return records
+
+
+class ChangeFeed:
+    # append-only JSONL log of every row an ingest changed, one record per
+    # line. cursors are byte offsets of record boundaries, so consumers can
+    # resume with GET /changes?since=<cursor>. only the ingest lock holder
+    # appends; the lock here serializes the apply worker threads.
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def append(self, records: list):
+        if not records:
+            return
+        data = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records)
+        with self.lock:
+            try:
+                with open(self.path, "a") as f:
+                    f.write(data)
+            except OSError as e:
+                logging.error(f"error writing change feed: {e}")
+
+    def read(self, since: int):
+        # returns the cursor after the last complete record and an iterator
+        # over the records between since and that cursor
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            if since != 0:
+                raise ValueError(f"cursor {since} is past the end of the feed")
+            return 0, iter(())
+        try:
+            # a record being appended right now may be incomplete
+            end = last_boundary(f.fileno(), os.fstat(f.fileno()).st_size)
+            if since < 0 or since > end:
+                raise ValueError(f"cursor {since} is outside the feed")
+            if since > 0 and os.pread(f.fileno(), 1, since - 1) != b"\n":
+                raise ValueError(f"cursor {since} is not a record boundary")
+        except:
+            f.close()
+            raise
+        f.seek(since)
+        return end, self.iter_records(f, end - since)
+
+    def iter_records(self, f, remaining: int):
+        with f:
+            while remaining > 0:
+                chunk = f.read(min(MANIFEST_READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+def last_boundary(fd: int, size: int) -> int:
+    # offset just past the last newline at or before size
+    pos = size
+    while pos > 0:
+        start = max(0, pos - MANIFEST_READ_CHUNK_SIZE)
+        i = os.pread(fd, pos - start, start).rfind(b"\n")
+        if i != -1:
+            return start + i + 1
+        pos = start
+    return 0
+
+
+change_feed = ChangeFeed(f"{RUN_DIR}/changes.jsonl")
+
+
+class Metrics:
+    # metrics rendered in the prometheus text format on /metrics. "last_"
+    # series describe the most recent ingest, "_total" series are cumulative.
+    # ingest series are shared between server processes through a file
+    # written by whichever process ran the ingest, the rest are per process.
+    def __init__(self, shared_path: str):
+        self.lock = threading.Lock()
+        self.types = {}
+        self.help = {}
+        self.values = defaultdict(dict)
+        self.shared = set()
+        # per-process counters carry a pid label, so a scrape served by
+        # another worker sees a different series rather than a reset
+        self.per_process = set()
+        self.shared_path = shared_path
+        self.shared_mtime = None
+
+    def declare(self, name: str, kind: str, help: str, shared: bool = False):
+        self.types[name] = kind
+        self.help[name] = help
+        if shared:
+            self.shared.add(name)
+        elif kind == "counter":
+            self.per_process.add(name)
+
+    def load_shared(self):
+        try:
+            mtime = os.stat(self.shared_path).st_mtime_ns
+            if mtime == self.shared_mtime:
+                return
+            with open(self.shared_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            for name, series in data.items():
+                if name in self.shared:
+                    self.values[name] = {
+                        tuple(tuple(pair) for pair in labels): value
+                        for labels, value in series
+                    }
+            self.shared_mtime = mtime
+
+    def save_shared(self):
+        with self.lock:
+            data = {
+                name: [[list(labels), value] for labels, value in self.values[name].items()]
+                for name in self.shared
+            }
+        try:
+            tmp_path = f"{self.shared_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.shared_path)
+            self.shared_mtime = os.stat(self.shared_path).st_mtime_ns
+        except OSError as e:
+            logging.error(f"error saving ingest metrics: {e}")
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.values[name][tuple(sorted(labels.items()))] = value
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + value
+
+    def record_ingest(self, job: IngestJob):
+        # called while holding the ingest lock, so no other process is
+        # writing the shared series
+        self.load_shared()
+        result = "success" if job.state == "finished" else "failure"
+        self.inc("cfingestor_ingests_total", result=result)
+        self.set("cfingestor_last_ingest_duration_seconds", job.elapsed())
+        self.inc("cfingestor_ingest_duration_seconds_total", job.elapsed())
+        self.set("cfingestor_last_ingest_timestamp_seconds", job.finished_at)
+        if result == "success":
+            self.set("cfingestor_last_ingest_success_timestamp_seconds", job.finished_at)
+        self.set(
+            "cfingestor_last_ingest_queue_wait_seconds",
+            job.started_at - job.created_at,
+        )
+        with self.lock:
+            for name in (
+                "cfingestor_last_ingest_phase_duration_seconds",
+                "cfingestor_last_ingest_phase_db_queries",
+                "cfingestor_last_ingest_phase_db_query_seconds",
+                "cfingestor_last_ingest_rows",
+            ):
+                self.values[name].clear()
+        for phase, stats in job.phases.items():
+            for name, value in (
+                ("phase_duration_seconds", stats["seconds"]),
+                ("phase_db_queries", stats["queries"]),
+                ("phase_db_query_seconds", stats["query_seconds"]),
+            ):
+                self.set(f"cfingestor_last_ingest_{name}", value, phase=phase)
+                self.inc(f"cfingestor_ingest_{name}_total", value, phase=phase)
+        for (model, action), n in job.rows.items():
+            self.set("cfingestor_last_ingest_rows", n, model=model, action=action)
+            self.inc("cfingestor_ingest_rows_total", n, model=model, action=action)
+        self.save_shared()
+
+    def render(self) -> str:
+        self.load_shared()
+        pid = os.getpid()
+        lines = []
+        with self.lock:
+            for name in sorted(self.types):
+                lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {self.types[name]}")
+                for labels, value in sorted(self.values[name].items()):
+                    if name in self.per_process:
+                        labels = (("pid", pid), *labels)
+                    if labels:
+                        label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+                        lines.append(f"{name}{{{label_str}}} {value}")
+                    else:
+                        lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(f"{RUN_DIR}/ingest_metrics.json")
+for _name, _kind, _help in [
+    ("cfingestor_ingests_total", "counter", "Ingests run, by result."),
+    ("cfingestor_ingest_rejections_total", "counter", "POST /ingest requests rejected with 425 because an ingest was locked."),
+    ("cfingestor_last_ingest_duration_seconds", "gauge", "Duration of the last ingest."),
+    ("cfingestor_ingest_duration_seconds_total", "counter", "Total time spent ingesting."),
+    ("cfingestor_last_ingest_timestamp_seconds", "gauge", "Unix time the last ingest finished."),
+    ("cfingestor_last_ingest_success_timestamp_seconds", "gauge", "Unix time the last successful ingest finished."),
+    ("cfingestor_last_ingest_queue_wait_seconds", "gauge", "Time the last ingest waited between POST and start."),
+    ("cfingestor_last_ingest_phase_duration_seconds", "gauge", "Duration of each phase of the last ingest."),
+    ("cfingestor_ingest_phase_duration_seconds_total", "counter", "Total time spent in each ingest phase."),
+    ("cfingestor_last_ingest_phase_db_queries", "gauge", "Database queries issued by each phase of the last ingest."),
+    ("cfingestor_ingest_phase_db_queries_total", "counter", "Total database queries issued by each ingest phase."),
+    ("cfingestor_last_ingest_phase_db_query_seconds", "gauge", "Database time of each phase of the last ingest."),
+    ("cfingestor_ingest_phase_db_query_seconds_total", "counter", "Total database time of each ingest phase."),
+    ("cfingestor_last_ingest_rows", "gauge", "Rows written by the last ingest, by model and action."),
+    ("cfingestor_ingest_rows_total", "counter", "Total rows written by ingests, by model and action."),
+    ("cfingestor_manifest_bytes", "gauge", "Size of the last saved manifest."),
+    ("cfingestor_manifest_users", "gauge", "Users in the last saved manifest."),
+    ("cfingestor_manifest_projects", "gauge", "Projects in the last saved manifest."),
+    ("cfingestor_last_manifest_parse_seconds", "gauge", "Time taken to parse the last posted manifest."),
+    ("cfingestor_manifest_parse_seconds_total", "counter", "Total time spent parsing posted manifests."),
+    ("cfingestor_http_requests_total", "counter", "HTTP requests, by route, method and status."),
+    ("cfingestor_http_request_duration_seconds_total", "counter", "Total time spent serving HTTP requests, by route and method."),
+]:
+    # the rejection counter is bumped by whichever process served the POST
+    _shared = _name.startswith(("cfingestor_last_ingest", "cfingestor_ingest")) and (
+        _name != "cfingestor_ingest_rejections_total"
+    )
+    metrics.declare(_name, _kind, _help, shared=_shared)
+
+
+api = Blueprint("cfingestor", __name__)
+ingest_queue = IngestQueue()
+auto_ingest = AutoIngest(AUTO_INGEST_DELAY)
+service_ready = False
+
+
+def create_app() -> Flask:
+    # the process-wide setup runs once, however many apps are created, so a
+    # gunicorn parent can do it before forking its workers
+    global service_ready
+    if not service_ready:
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        setup_logging()
+        setup_django()
+        os.register_at_fork(after_in_child=ingest_queue.after_fork)
+        os.register_at_fork(after_in_child=auto_ingest.after_fork)
+        service_ready = True
+    app = Flask(__name__)
+    app.register_blueprint(api)
+    return app
+
+
+@api.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@api.after_app_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.inc(
+        "cfingestor_http_requests_total",
+        route=route,
+        method=request.method,
+        status=response.status_code,
+    )
+    metrics.inc(
+        "cfingestor_http_request_duration_seconds_total",
+        time.perf_counter() - g.request_started,
+        route=route,
+        method=request.method,
+    )
+    return response
+
+
+@api.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@api.route("/manifest", methods=["POST"])
 def post_manifest():
     content_hash = request.headers.get("Content-Hash")
     if not content_hash:
         return {"error": "Content-Hash header is required"}, 400
-    try:
-        # yes i'm serializing and deserializing the json to ensure it's valid
-        j = request.json
-        if not j:
-            return {"error": "JSON body is required"}, 400
-        manifest = Manifest.from_json(json.dumps(j))
-    except Exception as e:
-        return {"error": str(e)}, 400
-    return manifest_post_handler(manifest, content_hash)
+    return manifest_post_handler(
+        request.stream,
+        content_hash,
+        content_type=request.mimetype,
+        content_encoding=request.headers.get("Content-Encoding", "").strip().lower(),
+    )
+
 
+@api.route("/manifest", methods=["PATCH"])
+def patch_manifest():
+    return manifest_patch_handler(request.get_data(), request.headers.get("If-Match"))
 
-@app.route("/manifest", methods=["GET"])
+
+@api.route("/manifest", methods=["GET"])
 def get_manifest():
-    return manifest_get_handler()
+    return manifest_get_handler(request.if_none_match, request.accept_encodings)
+
+
+@api.route("/changes", methods=["GET"])
+def get_changes():
+    return changes_get_handler(request.args.get("since", "0"))
+
+
+@api.route("/projects/<title>", methods=["GET"])
+def get_project(title: str):
+    return project_get_handler(title)
+
+
+@api.route("/users/<username>", methods=["GET"])
+def get_user(username: str):
+    return user_get_handler(username)
+
 
+@api.route("/lookup", methods=["POST"])
+def post_lookup():
+    return lookup_post_handler(request.get_data())
 
-@app.route("/ingest", methods=["POST"])
+
+@api.route("/ingest", methods=["POST"])
 def post_ingest():
-    return ingest_post_handler()
+    return ingest_post_handler(
+        dry_run=arg_flag("dry_run"), full=arg_flag("full"), body=request.get_data()
+    )
 
 
-@app.route("/ingest", methods=["GET"])
+@api.route("/ingest", methods=["GET"])
 def get_ingest():
     return ingest_get_handler()
 
 
+@api.route("/ingest/<job_id>", methods=["GET"])
+def get_ingest_job(job_id: str):
+    return ingest_job_get_handler(job_id)
+
+
+def arg_flag(name: str) -> bool:
+    return request.args.get(name, "").lower() in ("1", "true", "yes")
+
+
 def get_current_hash() -> str:
     try:
         with open(f"{RUN_DIR}/current_hash", "r") as f:
@@ -301,6 +2742,257 @@ def set_current_hash(h: str):
         f.write(h)
 
 
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def get_applied_hash() -> str:
+    try:
+        with open(f"{RUN_DIR}/applied_hash", "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def save_applied_manifest(manifest: Manifest, h: str):
+    # the manifest the last successful ingest applied, used to compute deltas
+    manifest.save_to_file(f"{RUN_DIR}/applied_manifest.json")
+    set_applied_hash(h)
+
+
+def set_applied_hash(h: str):
+    with open(f"{RUN_DIR}/applied_hash", "w") as f:
+        f.write(h)
+
+
+class ManifestCache:
+    # the parsed manifest and its serialized GET /manifest bodies, keyed on
+    # the current hash, with each content encoding compressed once on first
+    # request. the hash is read from disk on every request so a POST to
+    # another worker invalidates it.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.hash = None
+        self.manifest = None
+        self.bodies = {}
+
+    def store(self, h: str, manifest: Manifest):
+        with self.lock:
+            self.clear()
+            self.hash = h
+            self.manifest = manifest
+
+    def load(self, h: str) -> Manifest:
+        with self.lock:
+            if self.hash == h and self.manifest is not None:
+                return self.manifest
+        manifest = Manifest.load_from_file(f"{RUN_DIR}/manifest.json")
+        with self.lock:
+            if h and h == get_current_hash():
+                if self.hash != h:
+                    self.clear()
+                    self.hash = h
+                self.manifest = manifest
+        return manifest
+
+    def get(self, h: str, encoding: str) -> bytes:
+        with self.lock:
+            if self.hash != h:
+                self.clear()
+            body = self.bodies.get(encoding)
+            if body is not None:
+                return body
+            identity = self.bodies.get("identity")
+        if identity is None:
+            identity = self.load(h).to_json().encode()
+        body = encode_body(identity, encoding)
+        with self.lock:
+            # skip caching if a new manifest was saved while loading this one
+            if h and h == get_current_hash():
+                if self.hash != h:
+                    self.clear()
+                    self.hash = h
+                self.bodies["identity"] = identity
+                self.bodies[encoding] = body
+        return body
+
+
+def encode_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=MANIFEST_GZIP_LEVEL)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=MANIFEST_ZSTD_LEVEL).compress(body)
+    return body
+
+
+def response_encodings() -> list[str]:
+    # in order of preference when the client accepts several equally
+    if zstandard is not None:
+        return ["zstd", "gzip", "identity"]
+    return ["gzip", "identity"]
+
+
+manifest_cache = ManifestCache()
+
+
+def coldfront_memberships(cfmanager) -> dict:
+    # coldfront's side of the membership index, by name. a scoped snapshot
+    # only holds some of the rows, so it is merged into the saved state;
+    # associations are never deleted, only deactivated, so upserting by
+    # user and project keeps the merged state exact.
+    state = None
+    if cfmanager.scope is not None:
+        state = load_coldfront_memberships()
+    if state is None:
+        state = {"users": {}, "projects": {}}
+    for u in cfmanager.users_by_id.values():
+        state["users"][u.username] = {"is_active": u.is_active}
+    for p in cfmanager.projects_by_id.values():
+        project = state["projects"].setdefault(p.title, {"users": {}})
+        project["status"] = choice_name(cfmanager.project_statuses, p.status_id)
+    for a in cfmanager.associations_by_key.values():
+        user = cfmanager.users_by_id.get(a.user_id)
+        project = cfmanager.projects_by_id.get(a.project_id)
+        if user is None or project is None:
+            continue
+        state["projects"][project.title]["users"][user.username] = (
+            cfmanager.change_state("project_user", a)
+        )
+    return state
+
+
+def load_coldfront_memberships() -> dict | None:
+    try:
+        with open(f"{RUN_DIR}/coldfront_memberships.json", "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.error(f"error loading coldfront memberships: {e}")
+        return None
+
+
+def save_coldfront_memberships(cfmanager):
+    tmp_path = f"{RUN_DIR}/coldfront_memberships.json.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(coldfront_memberships(cfmanager), f)
+    os.replace(tmp_path, f"{RUN_DIR}/coldfront_memberships.json")
+
+
+def file_stamp(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+class Memberships:
+    # one immutable build of the membership index. entries are the response
+    # bodies, with a manifest and a coldfront part that are None when the
+    # user or project is missing on that side.
+    def __init__(self, key: tuple, manifest: Manifest, coldfront: dict | None):
+        self.key = key
+        self.hash = key[0]
+        self.projects = {}
+        self.users = {}
+        for u in manifest.users:
+            self.user(u.username)["manifest"] = {
+                "firstname": u.firstname,
+                "lastname": u.lastname,
+                "projects": {},
+            }
+        for p in manifest.projects:
+            self.project(p.name)["manifest"] = {
+                "owner": p.owner,
+                "admins": p.admins,
+                "users": p.users,
+            }
+            for username in (p.owner, *p.users):
+                if username == p.owner:
+                    role = "Owner"
+                elif username in p.admin_set:
+                    role = "Manager"
+                else:
+                    role = "User"
+                user = self.users.get(username)
+                if user is not None:
+                    user["manifest"]["projects"].setdefault(p.name, role)
+        if coldfront is None:
+            return
+        for username, user in coldfront["users"].items():
+            self.user(username)["coldfront"] = {**user, "projects": {}}
+        for title, project in coldfront["projects"].items():
+            self.project(title)["coldfront"] = project
+            for username, membership in project["users"].items():
+                entry = self.user(username)["coldfront"]
+                if entry is not None:
+                    entry["projects"][title] = membership
+
+    def user(self, username: str) -> dict:
+        entry = self.users.get(username)
+        if entry is None:
+            entry = {"username": username, "manifest": None, "coldfront": None}
+            self.users[username] = entry
+        return entry
+
+    def project(self, title: str) -> dict:
+        entry = self.projects.get(title)
+        if entry is None:
+            entry = {"title": title, "manifest": None, "coldfront": None}
+            self.projects[title] = entry
+        return entry
+
+
+class MembershipIndex:
+    # answers the membership lookups from memory. the index is rebuilt when
+    # the manifest hash or the coldfront memberships saved by the last
+    # ingest change, in this or another worker, and swapped in whole so
+    # readers never see a partial build.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = None
+
+    def get(self) -> Memberships:
+        key = (get_current_hash(), file_stamp(f"{RUN_DIR}/coldfront_memberships.json"))
+        current = self.current
+        if current is not None and current.key == key:
+            return current
+        with self.lock:
+            current = self.current
+            if current is None or current.key != key:
+                current = self.build(key)
+                self.current = current
+        return current
+
+    def build(self, key: tuple) -> Memberships:
+        h = key[0]
+        manifest = manifest_cache.load(h) if h else Manifest([], [])
+        started = time.perf_counter()
+        memberships = Memberships(key, manifest, load_coldfront_memberships())
+        logging.info(
+            f"membership index built in {time.perf_counter() - started:.3f}s: "
+            f"{len(memberships.users)} users, {len(memberships.projects)} projects"
+        )
+        return memberships
+
+    def refresh(self):
+        # rebuilds now rather than on the next lookup, once the index is in use
+        if self.current is not None:
+            try:
+                self.get()
+            except Exception as e:
+                logging.error(f"error rebuilding membership index: {e}")
+
+
+membership_index = MembershipIndex()
+
+
 def save_manifest(manifest: Manifest):
     try:
         with open(f"{RUN_DIR}/manifest.json", "w") as f:
@@ -317,341 +3009,450 @@ def load_manifest() -> Manifest:
         raise
 
 
-def manifest_post_handler(manifest: Manifest, content_hash: str):
+@contextmanager
+def manifest_lock():
+    # serializes manifest and hash writes across server processes so PATCH
+    # can compare the hash and swap the manifest atomically
+    fd = os.open(f"{RUN_DIR}/manifest.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def manifest_post_handler(
+    stream, content_hash: str, content_type: str = "", content_encoding: str = ""
+):
     logging.info("Received POST request on /manifest")
 
+    # Content-Hash identifies the decoded manifest whatever encoding it was
+    # sent in, so an unchanged manifest is skipped before decompressing it
     current_hash = get_current_hash()
     if content_hash == current_hash:
-        return exit_error(
-            {"status": "Manifest already saved", "hash": content_hash}
-        ), 200
+        return {"status": "Manifest already saved", "hash": content_hash}, 200
 
+    use_msgpack = content_type in MSGPACK_CONTENT_TYPES
+    if use_msgpack and msgpack is None:
+        return {"error": "msgpack manifests are not supported"}, 415
     try:
-        manifest.save_to_file(f"{RUN_DIR}/manifest.json")
-    except:
-        return exit_error({"status": "Error saving manifest"}), 500
+        stream = decoded_stream(stream, content_encoding)
+    except ValueError as e:
+        return {"error": str(e)}, 415
+
+    # the body is decompressed to disk as received and parsed once from
+    # there to validate it; JSON then replaces manifest.json as-is, msgpack
+    # is stored re-encoded as JSON
+    tmp_path = f"{RUN_DIR}/manifest.json.{uuid.uuid4().hex}.tmp"
+    try:
+        size = save_stream(stream, tmp_path)
+    except ManifestTooLarge as e:
+        remove_file(tmp_path)
+        return {"error": str(e)}, 413
+    except ManifestDecodeError as e:
+        # truncated or corrupt compressed bodies, or a dropped upload
+        remove_file(tmp_path)
+        if content_encoding not in ("", "identity"):
+            return {"error": f"Error decoding {content_encoding} body: {e}"}, 400
+        return {"error": f"Error reading body: {e}"}, 400
+    except Exception as e:
+        remove_file(tmp_path)
+        logging.error(f"error saving manifest: {e}")
+        return {"status": "Error saving manifest"}, 500
+    if size == 0:
+        remove_file(tmp_path)
+        return {"error": "JSON body is required"}, 400
+    try:
+        parse_started = time.perf_counter()
+        if use_msgpack:
+            manifest = load_msgpack_manifest(tmp_path)
+        else:
+            manifest = Manifest.load_from_file(tmp_path)
+        parse_seconds = time.perf_counter() - parse_started
+    except Exception as e:
+        remove_file(tmp_path)
+        return {"error": str(e)}, 400
+    metrics.set("cfingestor_last_manifest_parse_seconds", parse_seconds)
+    metrics.inc("cfingestor_manifest_parse_seconds_total", parse_seconds)
+    if use_msgpack:
+        try:
+            manifest.save_to_file(tmp_path)
+            size = os.path.getsize(tmp_path)
+        except:
+            remove_file(tmp_path)
+            return {"status": "Error saving manifest"}, 500
 
     try:
-        set_current_hash(content_hash)
+        with manifest_lock():
+            os.replace(tmp_path, f"{RUN_DIR}/manifest.json")
+            set_current_hash(content_hash)
     except:
-        return exit_error({"status": "Error saving hash"}), 500
+        remove_file(tmp_path)
+        return {"status": "Error saving manifest"}, 500
+    manifest_cache.store(content_hash, manifest)
 
+    metrics.set("cfingestor_manifest_bytes", size)
+    metrics.set("cfingestor_manifest_users", len(manifest.users))
+    metrics.set("cfingestor_manifest_projects", len(manifest.projects))
     logging.info("Manifest saved successfully")
-    return exit_error(
-        {"status": "Manifest saved successfully", "hash": content_hash}
-    ), 201
+    membership_index.refresh()
+    if AUTO_INGEST:
+        auto_ingest.schedule()
+    return {"status": "Manifest saved successfully", "hash": content_hash}, 201
 
 
-def manifest_get_handler():
+def manifest_patch_handler(body: bytes, if_match: str):
+    logging.info("Received PATCH request on /manifest")
+    if not if_match:
+        return {"error": "If-Match header with the current hash is required"}, 428
+    try:
+        operations = json.loads(body)["operations"]
+    except (ValueError, KeyError, TypeError):
+        return {"error": "JSON body with an operations list is required"}, 400
+
+    with manifest_lock():
+        current_hash = get_current_hash()
+        # the hash names the decoded document, so the weak ETag of GET
+        # /manifest is accepted as well as the bare hash
+        if if_match.removeprefix("W/").strip('"') != current_hash:
+            return {"error": "Manifest has changed", "hash": current_hash}, 412
+        try:
+            manifest = manifest_cache.load(current_hash)
+        except:
+            return {"status": "Error loading manifest"}, 500
+        try:
+            manifest = apply_manifest_operations(manifest, operations)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        # always hashed here: a client-supplied hash could repeat the old one
+        # and leave caches, the membership index and auto ingest unaware
+        # that the manifest changed
+        data = manifest.to_json().encode()
+        new_hash = hashlib.sha256(data).hexdigest()
+        tmp_path = f"{RUN_DIR}/manifest.json.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, f"{RUN_DIR}/manifest.json")
+            set_current_hash(new_hash)
+        except:
+            remove_file(tmp_path)
+            return {"status": "Error saving manifest"}, 500
+    manifest_cache.store(new_hash, manifest)
+
+    metrics.set("cfingestor_manifest_bytes", len(data))
+    metrics.set("cfingestor_manifest_users", len(manifest.users))
+    metrics.set("cfingestor_manifest_projects", len(manifest.projects))
+    logging.info(f"Manifest patched with {len(operations)} operations")
+    membership_index.refresh()
+    if AUTO_INGEST:
+        auto_ingest.schedule()
+    return {
+        "status": "Manifest updated successfully",
+        "hash": new_hash,
+        "operations": len(operations),
+    }, 200
+
+
+def manifest_get_handler(if_none_match, accept_encodings):
     logging.info("Called GET handler on activedirectory manifest endpoint")
 
+    # the Content-Hash the manifest was posted with doubles as its ETag. it
+    # is weak because the gzip, zstd and identity bodies share it
+    h = get_current_hash()
+    headers = {"Vary": "Accept-Encoding"}
+    if h:
+        headers["ETag"] = f'W/"{h}"'
+        if if_none_match.contains_weak(h):
+            return Response(status=304, headers=headers)
+
+    encoding = accept_encodings.best_match(response_encodings(), default="identity")
     try:
-        manifest = Manifest.load_from_file(f"{RUN_DIR}/manifest.json")
+        body = manifest_cache.get(h, encoding)
     except:
-        return exit_error({"status": "Error loading manifest"}), 500
-    return manifest.to_json(), 200
+        return {"status": "Error loading manifest"}, 500
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(body, status=200, headers=headers, mimetype="application/json")
+
+
+def changes_get_handler(since: str):
+    try:
+        end, records = change_feed.read(int(since))
+    except ValueError as e:
+        return {"error": f"Invalid cursor: {e}"}, 400
+    except OSError as e:
+        return {"status": f"Error reading change feed: {e}"}, 500
+    # the cursor to pass as since on the next request
+    return Response(
+        records,
+        status=200,
+        headers={"X-Changes-Cursor": str(end)},
+        mimetype="application/x-ndjson",
+    )
+
+
+def project_get_handler(title: str):
+    try:
+        memberships = membership_index.get()
+    except Exception:
+        return {"status": "Error loading membership index"}, 500
+    entry = memberships.projects.get(title)
+    if entry is None:
+        return {"status": f"Unknown project {title}"}, 404
+    return {"hash": memberships.hash, **entry}, 200
+
+
+def user_get_handler(username: str):
+    try:
+        memberships = membership_index.get()
+    except Exception:
+        return {"status": "Error loading membership index"}, 500
+    entry = memberships.users.get(username)
+    if entry is None:
+        return {"status": f"Unknown user {username}"}, 404
+    return {"hash": memberships.hash, **entry}, 200
+
+
+def lookup_post_handler(body: bytes):
+    # {"users": [...], "projects": [...]}, unknown names map to null
+    try:
+        data = json.loads(body)
+        if not isinstance(data, dict):
+            raise ValueError("expected a JSON object")
+        usernames = data.get("users", [])
+        titles = data.get("projects", [])
+        for name, values in (("users", usernames), ("projects", titles)):
+            if not isinstance(values, list) or not all(
+                isinstance(v, str) for v in values
+            ):
+                raise ValueError(f"{name} must be a list of strings")
+    except ValueError as e:
+        return {"error": f"Invalid lookup: {e}"}, 400
+    try:
+        memberships = membership_index.get()
+    except Exception:
+        return {"status": "Error loading membership index"}, 500
+    return {
+        "hash": memberships.hash,
+        "users": {u: memberships.users.get(u) for u in usernames},
+        "projects": {t: memberships.projects.get(t) for t in titles},
+    }, 200
 
 
 def ingest_get_handler():
-    l = is_ingest_locked()
-    if l:
-        return exit_error({"status": "Ingest is locked"}), 425
+    holder = ingest_queue.holder()
+    if holder is not None:
+        return {"status": "Ingest is locked", "job": holder}, 425
     return {"status": "Ingest is not locked"}
 
 
-def ingest_post_handler():
-    logging.info("Received POST request on /ingest")
-    l = is_ingest_locked()
-    if l:
-        return exit_error({"status": "Ingest is locked"}), 425
-    lock_ingest()
-    logging.info("ingest locked")
+def ingest_job_get_handler(job_id: str):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return {"status": f"Unknown ingest job {job_id}"}, 404
+    return job, 200
 
+
+def ingest_post_handler(dry_run: bool = False, full: bool = False, body: bytes = b""):
+    logging.info("Received POST request on /ingest")
+    try:
+        scope = parse_ingest_scope(body)
+    except ValueError as e:
+        return {"error": f"Invalid ingest scope: {e}"}, 400
+    if scope is not None and full:
+        return {"error": "full=1 cannot be combined with an ingest scope"}, 400
+    if dry_run:
+        return ingest_dry_run_handler(full, scope)
+    job_id, queued = ingest_queue.submit(full=full, scope=scope)
+    if not queued:
+        metrics.inc("cfingestor_ingest_rejections_total")
+        return {"status": "Ingest is locked", "job": job_id}, 425
+    logging.info(f"queued ingest job {job_id}")
+    return {"status": "Ingest queued", "job": job_id}, 202
+
+
+def run_ingest(job: IngestJob):
+    job.start_phase("loading")
     logging.info("reading manifest.json")
     try:
+        content_hash = get_current_hash()
         manifest = Manifest.load_from_file(f"{RUN_DIR}/manifest.json")
     except:
-        return exit_error({"status": "Error loading manifest"}), 500
+        return {"status": "Error loading manifest"}, 500
     logging.info("manifest read successfully")
-
-    cfmanager = ColdfrontModelManager()
-
-    logging.info("syncing users")
-    user_tracker = UserTracker(cfmanager.coldfront_users)
-    for user in manifest.users:
-        if user.username not in [u.username for u in cfmanager.coldfront_users]:
-            logging.info(f"creating user {user.username}")
-            email = f"{user.username}@{DOMAIN}"
-            try:
-                User.objects.create(
-                    email=email,
-                    username=user.username,
-                    first_name=user.firstname,
-                    last_name=user.lastname,
-                    is_active=True,
-                    is_staff=False,
-                    is_superuser=False,
-                )
-                logging.info(f"created user {user.username}")
-            except Exception as e:
-                logging.error(f"error creating user {user.username}: {e}")
-                return exit_error(
-                    {"status": f"Error creating user {user.username}: {e}"}
-                ), 500
-        cfuser = User.objects.get(username=user.username)
-        if not cfuser.is_active:
-            logging.info(f"activating user {user.username}")
-            cfuser.is_active = True
-            cfuser.save()
-            logging.info(f"activated user {user.username}")
-        user_tracker.tick(cfuser)
-    for user in user_tracker.remaining():
-        if user.username == "admin":
-            # skip django admin
-            continue
-        if not user.is_active:
-            # skip deactivated users
-            continue
-        logging.info(f"deactivating user {user.username}")
-        try:
-            user.is_active = False
-            user.save()
-            logging.info(f"deactivated user {user.username}")
-        except Exception as e:
-            logging.error(f"error deactivating user {user.username}: {e}")
-            return exit_error(
-                {"status": f"Error deactivating user {user.username}: {e}"}
-            ), 500
-    cfmanager.refresh_users()
-    logging.info("users synced successfully")
-
-    logging.info("syncing projects")
-    project_tracker = ProjectTracker(cfmanager.coldfront_projects)
-    project_active_status = ProjectStatusChoice.objects.get(name="Active")
-    project_archived_status = ProjectStatusChoice.objects.get(name="Archived")
-    for project in manifest.projects:
-        if project.name not in [p.title for p in cfmanager.coldfront_projects]:
-            logging.info(f"creating project {project.name}")
-            try:
-                cfpi = User.objects.get(username=project.owner)
-                Project.objects.create(
-                    title=project.name,
-                    pi=cfpi,
-                    description="enter description",
-                    status=project_active_status,
-                    requires_review=False,
-                    force_review=False,
-                )
-                logging.info(f"created project {project.name}")
-            except Exception as e:
-                logging.error(f"error creating project {project.name}: {e}")
-                return exit_error(
-                    {"status": f"Error creating project {project.name}: {e}"}
-                ), 500
-        cfproject = Project.objects.get(title=project.name)
-        cfproject.requires_review = True
-        cfproject.status = project_active_status
-        cfproject.description = "enter description"
-        cfproject.save()
-        project_tracker.tick(cfproject)
-    for project in project_tracker.remaining():
-        try:
-            logging.info(f"archiving project {project.name}")
-            p = Project.objects.get(title=project.title)
-            p.status = project_archived_status
-            p.save()
-            logging.info(f"archiving project {project.name}")
-        except Exception as e:
-            logging.error(f"error deactivating project {project.name}: {e}")
-            return exit_error(
-                {"status": f"Error deactivating project {project.name}: {e}"}
-            ), 500
-    cfmanager.refresh_projects()
-    logging.info("projects synced successfully")
-
-    logging.info("syncing associations")
-    cf_status_active = ProjectUserStatusChoice.objects.get(name="Active")
-    cf_status_inactive = ProjectUserStatusChoice.objects.get(name="Removed")
-    association_tracker = ProjectUserTracker(cfmanager.coldfront_associations)
-    for manifest_project in manifest.projects:
-        logging.info(f"processing project: {manifest_project.name}")
-        for username in manifest_project.users:
-            logging.info(f"processing user: {username}")
-            if manifest_project.owner == username:
-                logging.info(f"skipping pi: {username}")
-                # skip PIs
-                continue
-            # coldfront objects
-            cf_user = User.objects.get(username=username)
-            cf_project = Project.objects.get(title=manifest_project.name)
-            cf_role = ProjectUserRoleChoice.objects.get(name="User")
-            if username in manifest_project.admins:
-                cf_role = ProjectUserRoleChoice.objects.get(name="Manager")
-            # find a projectuser with the username and project name
+    job.content_hash = content_hash
+
+    checkpoint = ingest_checkpoint.load(content_hash)
+    scope = job.scope
+    if scope is None:
+        if checkpoint is not None and checkpoint["scope"]["mode"] == "full":
+            # an interrupted full sync is finished before going incremental
+            job.full = True
+        scope = load_ingest_scope(manifest, job.full)
+        if scope.is_empty():
+            logging.info("manifest already applied, nothing to ingest")
+            job.clear_checkpoint()
+            # the same content may arrive under a new hash, e.g. a full POST
+            # after a PATCH; record it so auto ingest stops re-diffing it
             try:
-                assoc = ProjectUser.objects.get(
-                    project=cf_project,
-                    user=cf_user,
-                )
-            except:
-                logging.info(
-                    f"creating association {cf_user.username} -> {cf_project.title}"
-                )
-                assoc = ProjectUser.objects.create(
-                    project=cf_project,
-                    user=cf_user,
-                    status=cf_status_active,
-                    role=cf_role,
-                )
-                logging.info(
-                    f"created association {cf_user.username} -> {cf_project.title}"
-                )
-            if assoc.role != cf_role:
-                logging.info(
-                    f"updating association role {cf_user.username} -> {cf_project.title}"
-                )
-                assoc.role = cf_role
-                assoc.save()
-                logging.info(
-                    f"updated association role {cf_user.username} -> {cf_project.title}"
-                )
-            if assoc.status != cf_status_active:
-                logging.info(
-                    f"activating association {cf_user.username} -> {cf_project.title}"
-                )
-                assoc.status = cf_status_active
-                assoc.save()
-                logging.info(
-                    f"activated association {cf_user.username} -> {cf_project.title}"
-                )
-            association_tracker.tick(cf_user, cf_project)
+                set_applied_hash(content_hash)
+            except OSError as e:
+                logging.error(f"error saving applied hash: {e}")
+            return {"status": "Manifest already applied", "hash": content_hash}, 200
+    if checkpoint is not None and checkpoint["scope"] == scope.to_dict():
+        job.resume(checkpoint)
+    job.checkpoint_scope = scope.to_dict()
+    scope.expand(manifest)
+
+    cfmanager = ColdfrontModelManager(scope)
+
+    job.start_phase("planning")
+    logging.info("planning ingest")
+    plan = plan_ingest(manifest, cfmanager, scope)
+    if plan.errors:
+        for error in plan.errors:
+            logging.error(f"error planning ingest: {error}")
+        return {"status": "Error planning ingest", "errors": plan.errors}, 500
+    logging.info("ingest planned successfully")
 
-    for association in association_tracker.remaining():
+    try:
+        apply_plan(plan, cfmanager, job)
+    except Exception as e:
+        return {"status": str(e), "errors": job.errors}, 500
+    finally:
+        # the snapshot holds the committed rows, whether or not every
+        # phase succeeded
         try:
-            f"deactivating association {association.user.username} -> {association.project.title}"
-            association.status = cf_status_inactive
-            association.save()
-            f"deactivated association {association.user.username} -> {association.project.title}"
+            save_coldfront_memberships(cfmanager)
         except Exception as e:
-            return {
-                "status": f"Error deactivating association {association.user.username} -> {association.project.title}: {e}"
-            }, 500
-    cfmanager.refresh_associations()
-    logging.info("associations synced successfully")
+            logging.error(f"error saving coldfront memberships: {e}")
+        membership_index.refresh()
+    if job.errors:
+        # keep the previous applied manifest so the next incremental
+        # ingest retries the rows that failed
+        return {
+            "status": "Ingest completed with errors",
+            "scope": scope.to_dict(),
+            "counts": plan.counts(),
+            "errors": job.errors,
+        }, 500
+    job.clear_checkpoint()
+
+    if scope.requested:
+        # the rest of the manifest was not applied, so the next incremental
+        # ingest still has to compare against the previous applied manifest
+        logging.info("scoped ingest, applied manifest left unchanged")
+        return {
+            "status": "Ingest completed successfully",
+            "scope": scope.to_dict(),
+            "counts": plan.counts(),
+        }, 200
+
+    try:
+        save_applied_manifest(manifest, content_hash)
+    except Exception as e:
+        logging.error(f"error saving applied manifest: {e}")
+        return {"status": f"Error saving applied manifest: {e}"}, 500
+
+    return {
+        "status": "Ingest completed successfully",
+        "scope": scope.to_dict(),
+        "counts": plan.counts(),
+    }, 200
 
-    logging.info("syncing resources")
+
+def ingest_dry_run_handler(full: bool = False, scope: IngestScope = None):
+    # read-only, so it neither takes nor releases the ingest lock
+    logging.info("reading manifest.json")
     try:
-        Resource.objects.get(name=RESOURCE_NAME)
+        manifest = Manifest.load_from_file(f"{RUN_DIR}/manifest.json")
     except:
-        logging.info(f"creating resource {RESOURCE_NAME}")
-        cf_resource_type = ResourceType.objects.get(name="Cluster")
-        Resource.objects.create(
-            name=RESOURCE_NAME,
-            description=RESOURCE_DESCRIPTION,
-            is_allocatable=True,
-            is_available=True,
-            is_public=True,
-            requires_payment=False,
-            resource_type=[cf_resource_type],
-        )
-        logging.info(f"created resource {RESOURCE_NAME}")
-    logging.info("resources synced successfully")
-
-    logging.info("syncing allocations")
-    allocation_tracker = AllocationTracker(cfmanager.coldfront_allocations)
-    cluster_resource = Resource.objects.get(name=RESOURCE_NAME)
-    cf_alloc_status_active = AllocationStatusChoice.objects.get(name="Active")
-    cf_alloc_status_expired = AllocationStatusChoice.objects.get(name="Expired")
-    for project in manifest.projects:
-        cf_project = Project.objects.get(title=project.name)
-        cf_allocation = allocation_tracker.get(cf_project)
-        if not cf_allocation:
-            try:
-                logging.info(f"creating allocation {project.name}")
-                cf_allocation = Allocation.objects.create(
-                    project=cf_project,
-                    start_date=ALLOCATION_START_DATE,
-                    end_date=ALLOCATION_END_DATE,
-                    status=cf_alloc_status_active,
-                )
-                cf_allocation.resources.set([cluster_resource])
-                cf_allocation.save()
-                logging.info(f"created allocation {project.name}")
-            except Exception as e:
-                logging.error(f"error creating allocation {project.name}: {e}")
-                return exit_error(
-                    {"status": f"Error creating allocation {project.name}: {e}"}
-                ), 500
-        allocation_tracker.tick(cf_allocation)
-    for remaining_allocation in allocation_tracker.remaining():
-        if remaining_allocation.status == cf_alloc_status_expired:
-            continue
-        try:
-            logging.info(
-                f"deactivating allocation {remaining_allocation.project.title}"
-            )
-            remaining_allocation.status = cf_alloc_status_expired
-            remaining_allocation.save()
-            logging.info(f"deactivated allocation {remaining_allocation.project.title}")
-        except Exception as e:
-            logging.error(
-                f"error deactivating allocation {remaining_allocation.project.title}: {e}"
-            )
-            return {
-                "status": f"Error deactivating allocation {remaining_allocation.project.title}: {e}"
-            }, 500
-    cfmanager.refresh_allocations()
-    logging.info("allocations synced successfully")
+        return {"status": "Error loading manifest"}, 500
+    logging.info("manifest read successfully")
 
-    logging.info("syncing allocation users")
-    allocation_user_tracker = AllocationUserTracker(
-        cfmanager.coldfront_allocation_users
-    )
-    cf_alloc_user_status_active = AllocationUserStatusChoice.objects.get(name="Active")
-    cf_alloc_user_status_removed = AllocationUserStatusChoice.objects.get(
-        name="Removed"
+    if scope is None:
+        scope = load_ingest_scope(manifest, full)
+        if scope.is_empty():
+            return {"status": "Manifest already applied", "scope": scope.to_dict()}, 200
+    scope.expand(manifest)
+
+    cfmanager = ColdfrontModelManager(scope)
+    logging.info("planning ingest")
+    plan = plan_ingest(manifest, cfmanager, scope)
+    return {
+        "status": "Dry run completed successfully",
+        "scope": scope.to_dict(),
+        **plan.summary(),
+    }, 200
+
+
+def parse_ingest_scope(body: bytes) -> IngestScope | None:
+    # {"users": [...], "projects": [...]}, either may be omitted
+    if not body.strip():
+        return None
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    usernames = data.get("users", [])
+    projects = data.get("projects", [])
+    for name, values in (("users", usernames), ("projects", projects)):
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise ValueError(f"{name} must be a list of strings")
+    if not usernames and not projects:
+        raise ValueError("users or projects are required")
+    return IngestScope(usernames, projects, requested=True)
+
+
+def load_ingest_scope(manifest: Manifest, full: bool) -> IngestScope:
+    if full:
+        logging.info("full resync requested")
+        return IngestScope.full()
+    try:
+        applied = Manifest.load_from_file(f"{RUN_DIR}/applied_manifest.json")
+    except FileNotFoundError:
+        logging.info("no applied manifest found, running a full ingest")
+        return IngestScope.full()
+    except Exception as e:
+        logging.error(f"error loading applied manifest, running a full ingest: {e}")
+        return IngestScope.full()
+    scope = manifest_delta(applied, manifest)
+    logging.info(
+        f"incremental ingest: {len(scope.usernames)} users and {len(scope.projects)} projects changed"
     )
-    for project in manifest.projects:
-        cf_project = Project.objects.get(title=project.name)
-        for username in project.users:
-            if project.owner == username:
-                # skip PIs
-                continue
-            cf_user = User.objects.get(username=username)
-            cf_allocation = get_allocation(cf_project, cfmanager.coldfront_allocations)
-            try:
-                allocation_user = AllocationUser.objects.get(
-                    allocation=cf_allocation,
-                    user=cf_user,
-                )
-            except:
-                logging.info(
-                    f"creating allocation user {cf_user.username} -> {cf_project.title}"
-                )
-                allocation_user = AllocationUser.objects.create(
-                    allocation=cf_allocation,
-                    user=cf_user,
-                    status=cf_alloc_user_status_active,
-                )
-                logging.info(
-                    f"created allocation user {cf_user.username} -> {cf_project.title}"
-                )
-            allocation_user_tracker.tick(cf_user, cf_allocation)
-    for allocation_user in allocation_user_tracker.remaining():
-        try:
-            f"removing allocation user {allocation_user.user.username} -> {allocation_user.allocation.project.title}"
-            allocation_user.status = cf_alloc_user_status_removed
-            allocation_user.save()
-        except Exception as e:
-            return {
-                "status": f"Error deactivating allocation user {allocation_user.user.username} -> {allocation_user.allocation.project.title}: {e}"
-            }, 500
-    cfmanager.refresh_allocation_users()
-    logging.info("allocation users synced successfully")
-
-    unlock_ingest()
-    logging.info("ingest unlocked")
-    return {"status": "Ingest completed successfully"}, 200
+    return scope
 
 
-app.run(host="0.0.0.0", port=8090)
+def serve():
+    # gunicorn with WORKERS processes of THREADS threads each when it is
+    # installed, flask's threaded server otherwise. the app is created here,
+    # so gunicorn workers fork from a parent that already set up django
+    app = create_app()
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        if WORKERS > 1:
+            logging.warning("gunicorn is not installed, serving with one process")
+        host, port = BIND.rsplit(":", 1)
+        app.run(host=host, port=int(port), threaded=True)
+        return
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", BIND)
+            self.cfg.set("workers", WORKERS)
+            self.cfg.set("threads", THREADS)
+            self.cfg.set("worker_class", "gthread")
+            # forked workers must open their own db connections
+            self.cfg.set("pre_fork", lambda server, worker: db_connections.close_all())
+
+        def load(self):
+            return app
+
+    logging.info(f"serving on {BIND} with {WORKERS} workers x {THREADS} threads")
+    Server().run()
+
+
+if __name__ == "__main__":
+    serve()
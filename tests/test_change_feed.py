@@ -0,0 +1,41 @@
+import pytest
+
+from main import ChangeFeed
+
+
+def read_all(feed: ChangeFeed, since: int) -> tuple[int, bytes]:
+    end, records = feed.read(since)
+    return end, b"".join(records)
+
+
+def test_empty_feed(tmp_path):
+    feed = ChangeFeed(str(tmp_path / "changes.jsonl"))
+    assert read_all(feed, 0) == (0, b"")
+    with pytest.raises(ValueError, match="past the end"):
+        feed.read(5)
+
+
+def test_cursors_resume_after_each_read(tmp_path):
+    feed = ChangeFeed(str(tmp_path / "changes.jsonl"))
+    feed.append([{"n": 1}, {"n": 2}])
+    end, data = read_all(feed, 0)
+    assert data == b'{"n":1}\n{"n":2}\n'
+    feed.append([{"n": 3}])
+    assert read_all(feed, end) == (end + len(b'{"n":3}\n'), b'{"n":3}\n')
+
+
+def test_partial_record_is_not_served(tmp_path):
+    path = tmp_path / "changes.jsonl"
+    feed = ChangeFeed(str(path))
+    feed.append([{"n": 1}])
+    with open(path, "ab") as f:
+        f.write(b'{"n":')
+    assert read_all(feed, 0) == (8, b'{"n":1}\n')
+
+
+@pytest.mark.parametrize("since", [-1, 3, 100])
+def test_invalid_cursors(tmp_path, since):
+    feed = ChangeFeed(str(tmp_path / "changes.jsonl"))
+    feed.append([{"n": 1}, {"n": 2}])
+    with pytest.raises(ValueError):
+        feed.read(since)
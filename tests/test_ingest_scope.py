@@ -0,0 +1,80 @@
+from main import IngestScope, Manifest, ManifestUser, manifest_delta
+
+
+def manifest(users: list, projects: list) -> Manifest:
+    return Manifest.from_dict(
+        {
+            "users": [
+                {"username": u, "firstname": f"{u}f", "lastname": f"{u}l"}
+                for u in users
+            ],
+            "projects": [
+                {"name": name, "owner": owner, "users": members, "admins": admins}
+                for name, owner, members, admins in projects
+            ],
+        }
+    )
+
+
+BASE = manifest(
+    ["alice", "bob", "carol", "dave"],
+    [
+        ("lab", "alice", ["alice", "bob"], ["alice"]),
+        ("core", "carol", ["carol", "dave"], ["carol"]),
+    ],
+)
+
+
+def test_identical_manifests_have_an_empty_delta():
+    assert manifest_delta(BASE, BASE).is_empty()
+
+
+def test_delta_names_changed_users_and_projects():
+    new = manifest(
+        ["alice", "bob", "carol", "erin"],
+        [
+            ("lab", "alice", ["alice", "bob"], ["alice", "bob"]),
+            ("core", "carol", ["carol", "dave"], ["carol"]),
+            ("new", "erin", ["erin"], []),
+        ],
+    )
+    scope = manifest_delta(BASE, new)
+    assert scope.usernames == {"dave", "erin"}
+    assert scope.projects == {"lab", "new"}
+    assert not scope.everything and not scope.requested
+
+
+def test_renamed_user_is_a_changed_user():
+    users = [
+        ManifestUser(u.username, "robert" if u.username == "bob" else u.firstname, u.lastname)
+        for u in BASE.users
+    ]
+    assert manifest_delta(BASE, Manifest(users, BASE.projects)).usernames == {"bob"}
+
+
+def test_expand_touches_projects_of_listed_users_and_their_owners():
+    scope = IngestScope(usernames=["dave"])
+    scope.expand(BASE)
+    assert scope.touched_projects == {"core"}
+    assert scope.touched_usernames == {"dave", "carol"}
+    # only the listed user may be deactivated
+    assert scope.has_user("dave") and not scope.has_user("carol")
+    assert not scope.has_project("core")
+    # every membership of a listed user is reconciled
+    assert scope.has_membership("dave", "lab")
+
+
+def test_expand_touches_members_of_listed_projects():
+    scope = IngestScope(projects=["lab"])
+    scope.expand(BASE)
+    assert scope.touched_projects == {"lab"}
+    assert scope.touched_usernames == {"alice", "bob"}
+    assert scope.has_membership("carol", "lab")
+    assert not scope.has_membership("carol", "core")
+
+
+def test_full_scope_touches_everything():
+    scope = IngestScope.full()
+    scope.expand(BASE)
+    assert scope.touches_user("anyone") and scope.has_project("anything")
+    assert scope.to_dict() == {"mode": "full"}
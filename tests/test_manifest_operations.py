@@ -0,0 +1,141 @@
+import pytest
+
+from main import Manifest, apply_manifest_operations
+
+
+def manifest() -> Manifest:
+    return Manifest.from_dict(
+        {
+            "users": [
+                {"username": name, "firstname": f"{name}f", "lastname": f"{name}l"}
+                for name in ("alice", "bob", "carol")
+            ],
+            "projects": [
+                {
+                    "name": "lab",
+                    "owner": "alice",
+                    "users": ["alice", "bob"],
+                    "admins": ["alice"],
+                },
+                # admin-only entries occur in posted manifests
+                {"name": "core", "owner": "bob", "users": ["bob"], "admins": ["carol"]},
+            ],
+        }
+    )
+
+
+def project(m: Manifest, name: str):
+    return m.projects_by_name[name]
+
+
+def test_add_user_and_member():
+    m = apply_manifest_operations(
+        manifest(),
+        [
+            {"op": "add_user", "username": "dave", "firstname": "d", "lastname": "v"},
+            {"op": "add_member", "project": "lab", "username": "dave"},
+        ],
+    )
+    assert m.users_by_name["dave"].firstname == "d"
+    assert project(m, "lab").users == ["alice", "bob", "dave"]
+    assert "dave" not in project(m, "lab").admin_set
+
+
+def test_add_member_is_idempotent():
+    m = apply_manifest_operations(
+        manifest(), [{"op": "add_member", "project": "lab", "username": "bob"}]
+    )
+    assert project(m, "lab").users == ["alice", "bob"]
+
+
+def test_add_admin_makes_a_member():
+    m = apply_manifest_operations(
+        manifest(), [{"op": "add_admin", "project": "lab", "username": "carol"}]
+    )
+    assert "carol" in project(m, "lab").user_set
+    assert "carol" in project(m, "lab").admin_set
+
+
+def test_remove_admin_keeps_membership():
+    m = apply_manifest_operations(
+        manifest(),
+        [
+            {"op": "add_admin", "project": "lab", "username": "bob"},
+            {"op": "remove_admin", "project": "lab", "username": "bob"},
+        ],
+    )
+    assert "bob" in project(m, "lab").user_set
+    assert "bob" not in project(m, "lab").admin_set
+
+
+def test_remove_member_drops_admin():
+    m = apply_manifest_operations(
+        manifest(),
+        [
+            {"op": "add_admin", "project": "lab", "username": "bob"},
+            {"op": "remove_member", "project": "lab", "username": "bob"},
+        ],
+    )
+    assert "bob" not in project(m, "lab").user_set
+    assert "bob" not in project(m, "lab").admin_set
+
+
+def test_owner_cannot_be_removed():
+    with pytest.raises(ValueError, match="owns lab"):
+        apply_manifest_operations(
+            manifest(), [{"op": "remove_member", "project": "lab", "username": "alice"}]
+        )
+    with pytest.raises(ValueError, match="owns lab"):
+        apply_manifest_operations(
+            manifest(), [{"op": "remove_user", "username": "alice"}]
+        )
+
+
+def test_set_owner_then_remove_previous_owner():
+    m = apply_manifest_operations(
+        manifest(),
+        [
+            {"op": "set_owner", "project": "lab", "username": "bob"},
+            {"op": "remove_member", "project": "lab", "username": "alice"},
+        ],
+    )
+    assert project(m, "lab").owner == "bob"
+    assert "alice" not in project(m, "lab").user_set
+
+
+def test_remove_user_strips_memberships_and_admin_only_entries():
+    m = apply_manifest_operations(
+        manifest(), [{"op": "remove_user", "username": "carol"}]
+    )
+    assert "carol" not in m.users_by_name
+    assert "carol" not in project(m, "core").admin_set
+    assert project(m, "core").admins == []
+
+
+def test_failed_operation_rejects_the_whole_patch():
+    original = manifest()
+    with pytest.raises(ValueError, match="operation 1: unknown user nobody"):
+        apply_manifest_operations(
+            original,
+            [
+                {"op": "add_member", "project": "lab", "username": "carol"},
+                {"op": "add_member", "project": "lab", "username": "nobody"},
+            ],
+        )
+    # the input manifest is never modified
+    assert project(original, "lab").users == ["alice", "bob"]
+
+
+@pytest.mark.parametrize(
+    "operations, message",
+    [
+        ({"op": "add_user"}, "operations must be a list"),
+        ([{"op": "rename", "project": "lab", "username": "bob"}], "unknown op rename"),
+        ([{"op": "add_member", "project": "nope", "username": "bob"}], "unknown project"),
+        ([{"op": "remove_user", "username": "nobody"}], "unknown user nobody"),
+        ([{"op": "add_member", "project": "lab"}], "operation 0"),
+    ],
+)
+def test_invalid_operations(operations, message):
+    with pytest.raises(ValueError, match=message):
+        apply_manifest_operations(manifest(), operations)